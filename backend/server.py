@@ -1,29 +1,228 @@
 import os
+import sys
+import base64
+import hashlib
+import hmac
 import uuid
-from datetime import datetime
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, Callable, Iterable
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, Field
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, CursorType, monitoring
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError, PyMongoError, CollectionInvalid
 import json
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+import logging
+import threading
+import traceback
+from collections import deque, OrderedDict
+from bisect import bisect_left
+from contextvars import Context, ContextVar
 import jwt
 import bcrypt
 from websockets.exceptions import ConnectionClosed
-from bson import json_util
+from bson import json_util, ObjectId
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
 from fastapi.middleware.cors import CORSMiddleware
 
 
+logger = logging.getLogger("xalvion")
+
+# Metrics configuration
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+# Plain dict-backed metrics: an update is a dict lookup plus an add, cheap
+# enough to leave on in production. Updates from Motor's executor threads can
+# race with the event loop; an occasional lost increment is acceptable here.
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+                for labels, value in self.values.items()]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = []
+        names = self.labelnames + ("le",)
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+# Values read from existing state at scrape time (socket counts, queue
+# depths, subsystem stats), so the hot path pays nothing for them
+class Collector:
+    def __init__(self, name: str, help: str, collect: Callable[[], Any], labelnames: tuple = (),
+                 kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labelnames = labelnames
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        values = self.collect()
+        if not self.labelnames:
+            return [f"{self.name} {values}"]
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in values]
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, name: str, help: str, collect: Callable[[], Any], labelnames: tuple = (),
+                  kind: str = "gauge") -> Collector:
+        return self.register(Collector(name, help, collect, labelnames, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+HTTP_REQUESTS = metrics.counter("xalvion_http_requests_total", "HTTP requests by route and status",
+                                ("method", "route", "status"))
+HTTP_LATENCY = metrics.histogram("xalvion_http_request_duration_seconds", "HTTP request latency by route",
+                                 ("method", "route"))
+DB_LATENCY = metrics.histogram("xalvion_mongo_command_duration_seconds", "MongoDB command latency by handler",
+                               ("handler", "command", "collection"))
+DB_FAILURES = metrics.counter("xalvion_mongo_command_failures_total", "Failed MongoDB commands",
+                              ("handler", "command", "collection"))
+WS_FANOUT = metrics.histogram("xalvion_ws_broadcast_recipients", "Sockets a single event was queued to",
+                              ("scope",), SIZE_BUCKETS)
+WS_DELIVER_LATENCY = metrics.histogram("xalvion_ws_deliver_duration_seconds",
+                                       "Time spent queueing one event to every recipient", ("scope",))
+WS_SEND_LATENCY = metrics.histogram("xalvion_ws_send_duration_seconds", "Time to write one frame to a socket")
+WS_CONNECTIONS = metrics.counter("xalvion_ws_connection_events_total", "Socket connects and disconnects",
+                                 ("event",))
+BCRYPT_LATENCY = metrics.histogram("xalvion_bcrypt_duration_seconds", "bcrypt hash/verify time",
+                                   ("operation",), (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+# Per-request context: the trace id stamped on every event the request
+# broadcasts, and the ASGI scope used to attribute DB calls to a route.
+# Motor copies the context into its executor, so command listeners see it too.
+request_context: ContextVar[Optional[dict]] = ContextVar("request_context", default=None)
+
+def handler_name(context: Optional[dict]) -> str:
+    if context is None:
+        return "background"
+    route = context["scope"].get("route")
+    return route.name if route is not None else "unmatched"
+
+def current_handler() -> str:
+    return handler_name(request_context.get())
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self.pending: Dict[int, tuple] = {}
+
+    def started(self, event):
+        collection = event.command.get("collection") if event.command_name == "getMore" \
+            else event.command.get(event.command_name)
+        self.pending[event.request_id] = (
+            current_handler(), event.command_name, collection if isinstance(collection, str) else ""
+        )
+
+    def succeeded(self, event):
+        labels = self.pending.pop(event.request_id, None)
+        if labels is not None:
+            DB_LATENCY.observe(event.duration_micros / 1e6, *labels)
+
+    def failed(self, event):
+        labels = self.pending.pop(event.request_id, None)
+        if labels is not None:
+            DB_LATENCY.observe(event.duration_micros / 1e6, *labels)
+            DB_FAILURES.inc(*labels)
+
 # Database setup
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(MONGO_URL)
+client = AsyncIOMotorClient(MONGO_URL, event_listeners=[MongoCommandMetrics()] if METRICS_ENABLED else [])
 db = client.xalvion_db
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'xalvion-super-secret-key-2025')
 JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL', '900'))
+REFRESH_TOKEN_TTL = int(os.environ.get('REFRESH_TOKEN_TTL', str(30 * 24 * 3600)))
+JWT_LEEWAY = int(os.environ.get('JWT_LEEWAY', '10'))
 
 app = FastAPI(title="Xalvion - Advanced Chat System", version="1.0.0")
 
@@ -36,6 +235,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Times every route and sets up request_context. Pure ASGI rather than
+# @app.middleware("http") to avoid the extra task and body streaming.
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            request_context.set({"trace_id": None, "scope": scope})
+            return await self.app(scope, receive, send)
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        trace_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id" and 0 < len(value) <= 64:
+                trace_id = value.decode("latin-1")
+                break
+        trace_id = trace_id or uuid.uuid4().hex
+        request_context.set({"trace_id": trace_id, "scope": scope})
+        status = [500]
+        
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", trace_id.encode("latin-1"))]
+            await send(message)
+        
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - started, scope["method"], route_path)
+            HTTP_REQUESTS.inc(scope["method"], route_path, status[0])
+
+if METRICS_ENABLED:
+    app.add_middleware(RequestMetricsMiddleware)
+
 
 # Security
 security = HTTPBearer()
@@ -73,78 +313,2147 @@ class MessageReaction(BaseModel):
     emoji: str
     action: str  # add, remove
 
+class MemberAdd(BaseModel):
+    user_id: str
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
+class ProfilerSettings(BaseModel):
+    enabled: bool
+    threshold_ms: Optional[float] = None
+
 # Helper function to handle MongoDB ObjectId serialization
 def parse_json(data):
     return json.loads(json_util.dumps(data))
 
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# Serialize a WebSocket event exactly once. The returned frame is shared by
+# every recipient, so no per-socket json.dumps or BSON round-trip happens.
+def encode_event(event_type: str, data: Any) -> str:
+    event = {"type": event_type, "data": data}
+    context = request_context.get()
+    if context is not None and context["trace_id"]:
+        event["trace_id"] = context["trace_id"]
+    if orjson is not None:
+        return orjson.dumps(event, default=_json_default).decode('utf-8')
+    return json.dumps(event, default=_json_default, separators=(',', ':'))
+
+def strip_mongo_id(document: dict) -> dict:
+    return {k: v for k, v in document.items() if k != "_id"}
+
+# Cache configuration
+TOPOLOGY_CACHE_SIZE = int(os.environ.get('TOPOLOGY_CACHE_SIZE', '100000'))
+TOPOLOGY_CACHE_TTL = float(os.environ.get('TOPOLOGY_CACHE_TTL', '300'))
+TOPOLOGY_CHANGE_STREAM = os.environ.get('TOPOLOGY_CHANGE_STREAM', 'false').lower() == 'true'
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '50000'))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+
+# Bounded LRU cache with per-entry expiry and hit/miss counters
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+# Channel -> server and server -> members lookups used on every broadcast and
+# access check. Writes in create_server/create_channel keep it current; the TTL
+# (or the optional change-stream listener) covers edits made elsewhere.
+class TopologyCache:
+    def __init__(self, maxsize: int = TOPOLOGY_CACHE_SIZE, ttl: float = TOPOLOGY_CACHE_TTL):
+        self.channel_servers = TTLCache(maxsize, ttl)
+        self.server_members = TTLCache(maxsize, ttl)
+        self.task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"restarts": 0}
+
+    async def get_channel_server(self, channel_id: str) -> Optional[str]:
+        server_id = self.channel_servers.get(channel_id)
+        if server_id is None:
+            channel = await db.channels.find_one({"channel_id": channel_id}, {"server_id": 1})
+            if not channel:
+                return None
+            server_id = channel["server_id"]
+            self.channel_servers.set(channel_id, server_id)
+        return server_id
+
+    async def get_server_members(self, server_id: str) -> Optional[set]:
+        members = self.server_members.get(server_id)
+        if members is None:
+            server = await db.servers.find_one({"server_id": server_id}, {"members": 1})
+            if not server:
+                return None
+            members = set(server.get("members", []))
+            self.server_members.set(server_id, members)
+        return members
+
+    async def is_member(self, server_id: str, user_id: str) -> bool:
+        members = await self.get_server_members(server_id)
+        return members is not None and user_id in members
+
+    def set_channel(self, channel_id: str, server_id: str):
+        self.channel_servers.set(channel_id, server_id)
+
+    def set_server_members(self, server_id: str, members: List[str]):
+        self.server_members.set(server_id, set(members))
+
+    def invalidate_channel(self, channel_id: str):
+        self.channel_servers.invalidate(channel_id)
+
+    def invalidate_server(self, server_id: str):
+        self.server_members.invalidate(server_id)
+
+    def start(self):
+        self.task = asyncio.create_task(self.watch())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def watch(self):
+        # Requires a replica set; invalidates entries for documents changed by other writers.
+        # A dropped stream is reopened with backoff instead of leaving only the TTL
+        pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+        delay = 0.5
+        resync = False
+        while True:
+            try:
+                async with db.watch(pipeline) as stream:
+                    if resync:
+                        # Changes made while the stream was down are not replayed
+                        self.channel_servers.clear()
+                        self.server_members.clear()
+                        manager.invalidate_authorization()
+                        resync = False
+                    async for change in stream:
+                        delay = 0.5
+                        await self.apply_change(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["restarts"] += 1
+                logger.warning("Topology change stream failed, retrying in %.1fs: %s", delay, e)
+                resync = True
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, BROADCAST_RETRY_MAX)
+
+    async def apply_change(self, change: dict):
+        collection = change["ns"]["coll"]
+        document_key = change["documentKey"]["_id"]
+        # Each worker runs its own watch, so socket authorization is invalidated locally
+        if collection == "servers":
+            server = await db.servers.find_one({"_id": document_key}, {"server_id": 1, "members": 1})
+            if server:
+                self.invalidate_server(server["server_id"])
+                # Current members may have just been added; former ones still list the server
+                manager.invalidate_authorization(user_ids=server.get("members", []))
+                manager.invalidate_authorization(server_id=server["server_id"])
+            else:
+                self.server_members.clear()
+                manager.invalidate_authorization()
+        elif collection == "channels":
+            channel = await db.channels.find_one({"_id": document_key}, {"channel_id": 1, "server_id": 1})
+            if channel:
+                self.invalidate_channel(channel["channel_id"])
+                manager.invalidate_authorization(server_id=channel["server_id"])
+            else:
+                self.channel_servers.clear()
+                manager.invalidate_authorization()
+
+topology = TopologyCache()
+
+# Authenticated user documents by user_id, without password hash or _id.
+# Anything that writes to a user document must call invalidate_user().
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+USER_CACHE_PROJECTION = {"_id": 0, "password": 0}
+
+def invalidate_user(user_id: str):
+    user_cache.invalidate(user_id)
+
+# WebSocket fan-out configuration
+WS_SEND_QUEUE_SIZE = int(os.environ.get('WS_SEND_QUEUE_SIZE', '256'))
+WS_SEND_TIMEOUT = float(os.environ.get('WS_SEND_TIMEOUT', '10'))
+WS_SLOW_CONSUMER_POLICY = os.environ.get('WS_SLOW_CONSUMER_POLICY', 'coalesce')  # drop, coalesce, disconnect
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+WS_HEARTBEAT_INTERVAL = float(os.environ.get('WS_HEARTBEAT_INTERVAL', '25'))
+WS_IDLE_TIMEOUT = float(os.environ.get('WS_IDLE_TIMEOUT', str(WS_HEARTBEAT_INTERVAL * 3)))
+
+WS_PER_MESSAGE_DEFLATE = os.environ.get('WS_PER_MESSAGE_DEFLATE', 'true').lower() == 'true'
+WS_CODEC_CACHE_SIZE = int(os.environ.get('WS_CODEC_CACHE_SIZE', '1024'))
+WS_SUBPROTOCOL_PREFIX = "xalvion."
+
+# Drop empty lists/dicts: binary clients are expected to default missing
+# fields, which saves the replies/reactions boilerplate on every message
+def _compact(value):
+    if isinstance(value, dict):
+        return {k: _compact(v) for k, v in value.items() if v != [] and v != {}}
+    if isinstance(value, list):
+        return [_compact(v) for v in value]
+    return value
+
+# Binary WebSocket encoding negotiated through the Sec-WebSocket-Protocol
+# header. Events are still built once as JSON frames; a codec transcodes each
+# distinct frame once and shares the bytes across every socket using it.
+class FrameCodec:
+    def __init__(self, name: str, dumps: Callable[[Any], bytes], loads: Callable[[bytes], Any],
+                 cache_size: int = WS_CODEC_CACHE_SIZE):
+        self.name = name
+        self.subprotocol = WS_SUBPROTOCOL_PREFIX + name
+        self.dumps = dumps
+        self.loads = loads
+        self.cache_size = cache_size
+        # Fan-out hands every socket the same frame string, so even a small
+        # insertion-ordered cache turns N transcodes into one
+        self.cache: Dict[str, bytes] = {}
+
+    def encode(self, frame: str) -> bytes:
+        payload = self.cache.get(frame)
+        if payload is None:
+            event = orjson.loads(frame) if orjson is not None else json.loads(frame)
+            payload = self.dumps(_compact(event))
+            if len(self.cache) >= self.cache_size:
+                del self.cache[next(iter(self.cache))]
+            self.cache[frame] = payload
+        return payload
+
+    def decode(self, payload: bytes) -> dict:
+        return self.loads(payload)
+
+WS_CODECS: Dict[str, FrameCodec] = {}
+if msgpack is not None:
+    WS_CODECS["msgpack"] = FrameCodec("msgpack", msgpack.packb, msgpack.unpackb)
+if cbor2 is not None:
+    WS_CODECS["cbor"] = FrameCodec("cbor", cbor2.dumps, cbor2.loads)
+
+# Pick the first subprotocol offered by the client that we support; None means JSON
+def negotiate_codec(websocket: WebSocket) -> Optional[FrameCodec]:
+    for offered in websocket.scope.get("subprotocols") or []:
+        if not offered.startswith(WS_SUBPROTOCOL_PREFIX):
+            continue
+        codec = WS_CODECS.get(offered[len(WS_SUBPROTOCOL_PREFIX):])
+        if codec is not None:
+            return codec
+    return None
+
+# A single socket with its own bounded outbound queue and writer task, so a
+# slow or stalled client only ever delays itself
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, user_id: str, manager: "ConnectionManager",
+                 session_id: Optional[str] = None, max_queue: int = WS_SEND_QUEUE_SIZE,
+                 policy: str = WS_SLOW_CONSUMER_POLICY, codec: Optional[FrameCodec] = None,
+                 auth: Optional["AuthorizationContext"] = None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.websocket = websocket
+        self.user_id = user_id
+        self.session_id = session_id or uuid.uuid4().hex
+        self.manager = manager
+        self.max_queue = max_queue
+        self.policy = policy
+        self.codec = codec
+        # Items are [coalesce_key, frame] so a keyed frame can be replaced in place
+        self.queue: deque = deque()
+        self.pending_keys: Dict[str, list] = {}
+        self.wakeup = asyncio.Event()
+        self.overflowed = False
+        self.closed = False
+        self.send_started: Optional[float] = None
+        self.last_seen = time.monotonic()
+        self.ended = False
+        self.rate_key = f"{user_id}:{self.session_id}"
+        self.auth = auth
+        self.writer_task: Optional[asyncio.Task] = None
+
+    async def receive(self) -> dict:
+        # Clients may send either JSON text or frames in their negotiated codec
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("bytes") is not None and self.codec is not None:
+            return self.codec.decode(message["bytes"])
+        return json.loads(message.get("text") or message.get("bytes"))
+
+    def start(self):
+        self.writer_task = asyncio.create_task(self._writer())
+
+    def stop(self):
+        self.closed = True
+        self.queue.clear()
+        self.pending_keys.clear()
+        if self.writer_task and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+
+    def enqueue(self, frame: str, coalesce_key: Optional[str] = None) -> bool:
+        if self.closed or self.overflowed:
+            return False
+        stats = self.manager.stats
+        if self.send_started is not None and time.monotonic() - self.send_started > WS_SEND_TIMEOUT:
+            # The writer has been stuck on one frame for too long: treat the socket as dead
+            stats["stalled"] += 1
+            self.stop()
+            return False
+        if self.policy == "coalesce" and coalesce_key is not None:
+            pending = self.pending_keys.get(coalesce_key)
+            if pending is not None:
+                pending[1] = frame
+                stats["coalesced"] += 1
+                return True
+        if len(self.queue) >= self.max_queue:
+            if self.policy == "drop":
+                stats["dropped"] += 1
+                return False
+            if self.policy == "disconnect":
+                # Let the writer close the socket; the receive loop then cleans up
+                self.overflowed = True
+                self.queue.clear()
+                self.pending_keys.clear()
+                self.wakeup.set()
+                stats["slow_disconnects"] += 1
+                return False
+            # coalesce: latest state wins, evict the oldest pending frame
+            self._forget(self.queue.popleft())
+            stats["dropped"] += 1
+        item = [coalesce_key, frame]
+        self.queue.append(item)
+        if coalesce_key is not None:
+            self.pending_keys[coalesce_key] = item
+        self.wakeup.set()
+        return True
+
+    def _forget(self, item: list):
+        key = item[0]
+        if key is not None and self.pending_keys.get(key) is item:
+            del self.pending_keys[key]
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                if not self.queue and not self.overflowed:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                if self.overflowed:
+                    await asyncio.wait_for(self.websocket.close(code=1013), WS_SEND_TIMEOUT)
+                    break
+                while self.queue:
+                    item = self.queue.popleft()
+                    self._forget(item)
+                    # Stall detection is done lazily in enqueue(); wrapping every
+                    # send in wait_for() costs an extra task per frame
+                    send_started = self.send_started = time.monotonic()
+                    if self.codec is None:
+                        await self.websocket.send_text(item[1])
+                    else:
+                        await self.websocket.send_bytes(self.codec.encode(item[1]))
+                    self.send_started = None
+                    WS_SEND_LATENCY.observe(time.monotonic() - send_started)
+                    self.manager.stats["sent"] += 1
+        except asyncio.CancelledError:
+            pass
+        except (ConnectionClosed, WebSocketDisconnect, RuntimeError, asyncio.TimeoutError):
+            self.manager.stats["send_errors"] += 1
+        finally:
+            self.manager.release(self)
+
+# Cross-process broadcast bus configuration
+BROADCAST_BACKEND = os.environ.get('BROADCAST_BACKEND', 'memory')  # memory, redis, mongo
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+BROADCAST_CHANNEL = os.environ.get('BROADCAST_CHANNEL', 'xalvion:broadcast')
+BROADCAST_CAPPED_BYTES = int(os.environ.get('BROADCAST_CAPPED_BYTES', str(64 * 1024 * 1024)))
+NODE_ID = os.environ.get('NODE_ID') or uuid.uuid4().hex[:12]
+BROADCAST_RETRY_MAX = float(os.environ.get('BROADCAST_RETRY_MAX', '30'))
+
+# Every broadcast is published on the bus and delivered by each worker to the
+# sockets it holds. Publishers deliver to their own sockets directly, so the
+# remote backends skip envelopes that came from this node.
+def pack_envelope(scope: str, target: str, frame: str, coalesce_key: Optional[str]) -> str:
+    return f"{NODE_ID}\x1f{scope}\x1f{target}\x1f{coalesce_key or ''}\n{frame}"
+
+def unpack_envelope(data: str) -> tuple:
+    header, frame = data.split("\n", 1)
+    origin, scope, target, coalesce_key = header.split("\x1f")
+    return origin, scope, target, frame, coalesce_key or None
+
+class InMemoryBus:
+    def __init__(self, manager: "ConnectionManager"):
+        self.manager = manager
+        self.stats: Dict[str, int] = {"received": 0, "malformed": 0, "reconnects": 0, "resyncs": 0,
+                                      "publish_failures": 0}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, scope: str, target: str, frame: str, coalesce_key: Optional[str] = None):
+        self.manager.deliver(scope, target, frame, coalesce_key)
+
+    def receive(self, envelope: str):
+        # One bad envelope must not take the listener down with it
+        try:
+            origin, scope, target, frame, coalesce_key = unpack_envelope(envelope)
+        except (AttributeError, TypeError, ValueError):
+            self.stats["malformed"] += 1
+            logger.warning("Dropping malformed broadcast envelope: %.200r", envelope)
+            return
+        if origin != NODE_ID:
+            self.stats["received"] += 1
+            self.manager.deliver(scope, target, frame, coalesce_key)
+
+    def resync(self):
+        # Envelopes published while this worker was not listening are gone
+        self.stats["resyncs"] += 1
+        self.manager.resync()
+
+    def publish_failed(self, error: Exception):
+        # Callers publish after their write committed; failing them would
+        # invite a retry that duplicates it, so other workers just miss this one
+        self.stats["publish_failures"] += 1
+        logger.warning("%s publish failed, delivered locally only: %s", type(self).__name__, error)
+
+    async def backoff(self, delay: float, error: Exception) -> float:
+        self.stats["reconnects"] += 1
+        logger.warning("%s listener failed, retrying in %.1fs: %s", type(self).__name__, delay, error)
+        await asyncio.sleep(delay)
+        return min(delay * 2, BROADCAST_RETRY_MAX)
+
+class RedisBus(InMemoryBus):
+    def __init__(self, manager: "ConnectionManager", url: str = REDIS_URL, channel: str = BROADCAST_CHANNEL):
+        if aioredis is None:
+            raise RuntimeError("BROADCAST_BACKEND=redis requires the redis package")
+        super().__init__(manager)
+        self.url = url
+        self.channel = channel
+        self.redis = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.redis = aioredis.from_url(self.url, decode_responses=True)
+        self.task = asyncio.create_task(self._listen(await self._subscribe()))
+
+    async def _subscribe(self):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.channel)
+        return pubsub
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        if self.redis:
+            await self.redis.aclose()
+
+    async def publish(self, scope: str, target: str, frame: str, coalesce_key: Optional[str] = None):
+        self.manager.deliver(scope, target, frame, coalesce_key)
+        try:
+            await self.redis.publish(self.channel, pack_envelope(scope, target, frame, coalesce_key))
+        except (aioredis.RedisError, OSError) as e:
+            self.publish_failed(e)
+
+    async def _listen(self, pubsub):
+        delay = 0.5
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = await self._subscribe()
+                    # Pub/sub keeps no history, so whatever was sent meanwhile is lost
+                    self.resync()
+                async for item in pubsub.listen():
+                    delay = 0.5
+                    self.receive(item["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+                pubsub = None
+                delay = await self.backoff(delay, e)
+
+# Tails a capped collection rather than using a change stream, so it also
+# works against a standalone mongod without a replica set
+class MongoBus(InMemoryBus):
+    def __init__(self, manager: "ConnectionManager", collection: str = "broadcast_events"):
+        super().__init__(manager)
+        self.collection_name = collection
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        try:
+            await db.create_collection(self.collection_name, capped=True, size=BROADCAST_CAPPED_BYTES)
+        except CollectionInvalid:
+            pass
+        collection = db[self.collection_name]
+        # Tailable cursors die on an empty collection, so make sure it has a document
+        await collection.insert_one({"origin": NODE_ID, "envelope": None})
+        last = await collection.find_one(sort=[("$natural", -1)])
+        self.task = asyncio.create_task(self._tail(last["_id"]))
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def publish(self, scope: str, target: str, frame: str, coalesce_key: Optional[str] = None):
+        self.manager.deliver(scope, target, frame, coalesce_key)
+        try:
+            await db[self.collection_name].insert_one({
+                "origin": NODE_ID,
+                "envelope": pack_envelope(scope, target, frame, coalesce_key)
+            })
+        except PyMongoError as e:
+            self.publish_failed(e)
+
+    async def _tail(self, last_id):
+        collection = db[self.collection_name]
+        delay = 0.5
+        while True:
+            try:
+                cursor = collection.find({"_id": {"$gt": last_id}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                async for event in cursor:
+                    last_id = event["_id"]
+                    delay = 0.5
+                    if event["origin"] != NODE_ID and event["envelope"]:
+                        self.receive(event["envelope"])
+                await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == 136:
+                    # CappedPositionLost: the collection wrapped past this reader,
+                    # so skip to the newest event and have clients refetch
+                    newest = await collection.find_one(sort=[("$natural", -1)], projection={"_id": 1})
+                    if newest is not None:
+                        last_id = newest["_id"]
+                    self.resync()
+                delay = await self.backoff(delay, e)
+            except Exception as e:
+                # Resumes from last_id on the next pass
+                delay = await self.backoff(delay, e)
+
+BROADCAST_BACKENDS = {"memory": InMemoryBus, "redis": RedisBus, "mongo": MongoBus}
+
+# Replay log configuration
+REPLAY_LOG_SIZE = int(os.environ.get('REPLAY_LOG_SIZE', '200'))
+REPLAY_LOG_SERVERS = int(os.environ.get('REPLAY_LOG_SERVERS', '2000'))
+REPLAY_LOG_BYTES = int(os.environ.get('REPLAY_LOG_BYTES', str(64 * 1024 * 1024)))
+REPLAY_SPILL = os.environ.get('REPLAY_SPILL', 'false').lower() == 'true'
+REPLAY_SPILL_TTL = int(os.environ.get('REPLAY_SPILL_TTL', '3600'))
+
+# Stamps every non-ephemeral server event delivered by this worker with a
+# per-server sequence number and keeps the last REPLAY_LOG_SIZE of them, so a
+# reconnecting client can send `resume` and receive only what it missed.
+# Past REPLAY_LOG_BYTES in total, the oldest frames of the least recently
+# active servers go first.
+# Frames carrying a coalesce key (typing) are ephemeral and not sequenced.
+# Sequences are only meaningful within one epoch (one worker process); a
+# client resuming against another epoch is told to resync over REST.
+class ReplayLog:
+    def __init__(self, size: int = REPLAY_LOG_SIZE, max_servers: int = REPLAY_LOG_SERVERS,
+                 max_bytes: int = REPLAY_LOG_BYTES, spill: bool = REPLAY_SPILL):
+        self.epoch = f"{NODE_ID}-{uuid.uuid4().hex[:8]}"
+        self.size = size
+        self.max_servers = max_servers
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.sequences: Dict[str, int] = {}
+        self.logs: "OrderedDict[str, deque]" = OrderedDict()
+        self.frames = 0
+        self.bytes = 0
+        self.evicted = 0
+        self.spill_buffer: List[dict] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def record(self, server_id: str, frame: str) -> str:
+        seq = self.sequences.get(server_id, 0) + 1
+        self.sequences[server_id] = seq
+        # Frames are JSON objects, so the stream position can be appended
+        # without decoding and re-encoding the event
+        stamped = f'{frame[:-1]},"server_id":{json.dumps(server_id)},"seq":{seq}}}'
+        log = self.logs.get(server_id)
+        if log is None:
+            log = self.logs[server_id] = deque()
+            while len(self.logs) > self.max_servers:
+                evicted_id, evicted_log = self.logs.popitem(last=False)
+                while evicted_log:
+                    self._evict(evicted_id, evicted_log)
+        else:
+            self.logs.move_to_end(server_id)
+        if len(log) >= self.size:
+            self._evict(server_id, log)
+        log.append((seq, stamped))
+        self.frames += 1
+        self.bytes += len(stamped)
+        # The server just written to is the most recent, so it is trimmed
+        # last and always keeps the frame it was given
+        while self.bytes > self.max_bytes:
+            oldest_id, oldest_log = next(iter(self.logs.items()))
+            if oldest_log is log and len(log) == 1:
+                break
+            self._evict(oldest_id, oldest_log)
+            if not oldest_log:
+                del self.logs[oldest_id]
+        return stamped
+
+    def _evict(self, server_id: str, log: deque):
+        # Drops from the front, so what stays is still a contiguous tail
+        evicted_seq, evicted_frame = log.popleft()
+        self.frames -= 1
+        self.bytes -= len(evicted_frame)
+        self.evicted += 1
+        if self.spill:
+            self.spill_buffer.append({
+                "server_id": server_id,
+                "epoch": self.epoch,
+                "seq": evicted_seq,
+                "frame": evicted_frame,
+                "created_at": datetime.utcnow()
+            })
+
+    def latest(self, server_id: str) -> int:
+        return self.sequences.get(server_id, 0)
+
+    async def since(self, server_id: str, last_seq: int) -> Optional[List[str]]:
+        # None means the gap can no longer be filled and the client must resync
+        if last_seq >= self.latest(server_id):
+            return []
+        log = self.logs.get(server_id)
+        memory = [(seq, frame) for seq, frame in log if seq > last_seq] if log else []
+        if memory and memory[0][0] == last_seq + 1:
+            return [frame for _, frame in memory]
+        if not self.spill:
+            return None
+        await self.flush()
+        first_in_memory = memory[0][0] if memory else self.latest(server_id) + 1
+        spilled = await db.replay_events.find(
+            {"server_id": server_id, "epoch": self.epoch, "seq": {"$gt": last_seq, "$lt": first_in_memory}},
+            {"_id": 0, "seq": 1, "frame": 1}
+        ).sort("seq", ASCENDING).to_list(None)
+        if not spilled or spilled[0]["seq"] != last_seq + 1:
+            return None
+        return [event["frame"] for event in spilled] + [frame for _, frame in memory]
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"servers": len(self.logs), "frames": self.frames, "bytes": self.bytes, "evicted": self.evicted}
+
+    async def flush(self):
+        if self.spill_buffer:
+            batch, self.spill_buffer = self.spill_buffer, []
+            try:
+                await db.replay_events.insert_many(batch, ordered=False)
+            except PyMongoError as e:
+                logger.warning("Replay spill lost %d events: %s", len(batch), e)
+
+    def start(self):
+        if self.spill:
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(1)
+            await self.flush()
+
 # Connection Manager for WebSocket
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        # user_id -> session_id -> connection; a user may have several tabs/devices
+        self.active_connections: Dict[str, Dict[str, ClientConnection]] = {}
         self.user_presence: Dict[str, Dict[str, Any]] = {}
-        self.server_members: Dict[str, List[str]] = {}
-        
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        self.user_presence[user_id] = {
-            "status": "online",
-            "last_seen": datetime.utcnow().isoformat(),
-            "activity": "online"
+        # Bidirectional live-membership index: server -> users and user -> servers
+        self.server_members: Dict[str, set] = {}
+        self.user_servers: Dict[str, set] = {}
+        self.bus = InMemoryBus(self)
+        # Bus scopes that carry state changes for every worker rather than frames for sockets
+        self.control_handlers: Dict[str, Callable[[str, str], None]] = {
+            "authz_user": lambda target, _: self.invalidate_authorization(user_ids=(target,)),
+            "authz_server": lambda target, _: self.invalidate_authorization(server_id=target),
+            "topology_server": lambda target, _: topology.invalidate_server(target),
         }
+        self.replay = ReplayLog()
+        self.stats: Dict[str, int] = {
+            "sent": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "slow_disconnects": 0,
+            "stalled": 0,
+            "send_errors": 0,
+        }
+        
+    async def connect(self, websocket: WebSocket, user_id: str, session_id: Optional[str] = None,
+                      auth: Optional["AuthorizationContext"] = None) -> ClientConnection:
+        codec = negotiate_codec(websocket)
+        await websocket.accept(subprotocol=codec.subprotocol if codec else None)
+        sessions = self.active_connections.setdefault(user_id, {})
+        connection = ClientConnection(websocket, user_id, self, session_id, codec=codec, auth=auth)
+        previous = sessions.get(connection.session_id)
+        if previous:
+            # The same tab reconnecting: replace its stale socket, not the other sessions
+            previous.stop()
+        sessions[connection.session_id] = connection
+        connection.start()
+        WS_CONNECTIONS.inc("connect")
+        if len(sessions) == 1:
+            self.user_presence[user_id] = {
+                "status": "online",
+                "last_seen": datetime.utcnow().isoformat(),
+                "activity": "online"
+            }
+        return connection
         
-    def disconnect(self, user_id: str):
+    def disconnect(self, connection: ClientConnection) -> bool:
+        # Returns True when this was the user's last session
+        user_id = connection.user_id
+        sessions = self.active_connections.get(user_id)
+        if sessions and sessions.get(connection.session_id) is connection:
+            del sessions[connection.session_id]
+            if not sessions:
+                del self.active_connections[user_id]
+            WS_CONNECTIONS.inc("disconnect")
+        connection.stop()
         if user_id in self.active_connections:
-            del self.active_connections[user_id]
+            return False
         if user_id in self.user_presence:
             self.user_presence[user_id]["status"] = "offline"
             self.user_presence[user_id]["last_seen"] = datetime.utcnow().isoformat()
+        return True
+
+    def is_online(self, user_id: str) -> bool:
+        return user_id in self.active_connections
+
+    def session_count(self) -> int:
+        return sum(len(sessions) for sessions in self.active_connections.values())
+
+    def join_server(self, server_id: str, user_id: str) -> bool:
+        members = self.server_members.setdefault(server_id, set())
+        if user_id in members:
+            return False
+        members.add(user_id)
+        self.user_servers.setdefault(user_id, set()).add(server_id)
+        return True
+
+    def leave_all_servers(self, user_id: str) -> set:
+        servers = self.user_servers.pop(user_id, set())
+        for server_id in servers:
+            members = self.server_members.get(server_id)
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self.server_members[server_id]
+        return servers
+
+    def leave_server(self, server_id: str, user_id: str):
+        members = self.server_members.get(server_id)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self.server_members[server_id]
+        servers = self.user_servers.get(user_id)
+        if servers is not None:
+            servers.discard(server_id)
+            if not servers:
+                del self.user_servers[user_id]
+
+    def invalidate_authorization(self, user_ids: Optional[Iterable[str]] = None,
+                                 server_id: Optional[str] = None) -> int:
+        # Only marks contexts stale; each receive loop reloads its own on the
+        # next frame it has to check. With no arguments every session is hit.
+        if user_ids is not None:
+            connections = [connection for user_id in user_ids
+                           for connection in self.active_connections.get(user_id, {}).values()]
+        else:
+            connections = [connection for sessions in self.active_connections.values()
+                           for connection in sessions.values()]
+        invalidated = 0
+        for connection in connections:
+            auth = connection.auth
+            if auth is None or auth.stale:
+                continue
+            if server_id is None or server_id in auth.servers:
+                auth.stale = True
+                invalidated += 1
+        return invalidated
+
+    def resync(self):
+        # Called when bus envelopes were lost: drop every cache the bus keeps
+        # fresh and have each local socket refetch instead of resuming
+        topology.channel_servers.clear()
+        topology.server_members.clear()
+        recent_messages.channels.clear()
+        self.invalidate_authorization()
+        frame = encode_event("resync_required", {"epoch": self.replay.epoch})
+        for sessions in self.active_connections.values():
+            for connection in sessions.values():
+                connection.enqueue(frame)
+
+    def release(self, connection: ClientConnection):
+        # Called by a writer that gave up; disconnect() ignores stale sessions
+        self.disconnect(connection)
     
-    async def send_personal_message(self, message: str, user_id: str):
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_text(message)
-            except ConnectionClosed:
-                self.disconnect(user_id)
+    def deliver(self, scope: str, target: str, message: str, coalesce_key: Optional[str] = None):
+        # Enqueue only; each connection's writer task does the actual send
+        handler = self.control_handlers.get(scope)
+        if handler is not None:
+            handler(target, message)
+            return
+        started = time.perf_counter()
+        recipients = 0
+        connections = self.active_connections
+        if scope == "server":
+            user_ids = self.server_members.get(target, ())
+            if coalesce_key is None:
+                message = self.replay.record(target, message)
+        else:
+            user_ids = (target,)
+        for user_id in user_ids:
+            sessions = connections.get(user_id)
+            if sessions:
+                for connection in sessions.values():
+                    connection.enqueue(message, coalesce_key)
+                recipients += len(sessions)
+        WS_FANOUT.observe(recipients, scope)
+        WS_DELIVER_LATENCY.observe(time.perf_counter() - started, scope)
     
-    async def broadcast_to_server(self, message: str, server_id: str):
-        if server_id in self.server_members:
-            for user_id in self.server_members[server_id]:
-                await self.send_personal_message(message, user_id)
+    async def send_personal_message(self, message: str, user_id: str, coalesce_key: Optional[str] = None):
+        await self.bus.publish("user", user_id, message, coalesce_key)
     
-    async def broadcast_to_channel(self, message: str, channel_id: str):
+    async def broadcast_to_server(self, message: str, server_id: str, coalesce_key: Optional[str] = None):
+        await self.bus.publish("server", server_id, message, coalesce_key)
+    
+    async def broadcast_to_channel(self, message: str, channel_id: str, coalesce_key: Optional[str] = None):
         # Get all users in the channel's server
-        channel = await db.channels.find_one({"channel_id": channel_id})
-        if channel:
-            await self.broadcast_to_server(message, channel["server_id"])
+        server_id = await topology.get_channel_server(channel_id)
+        if server_id:
+            await self.broadcast_to_server(message, server_id, coalesce_key)
 
 manager = ConnectionManager()
 
+# Presence updates are debounced per user and delivered as one presence_batch
+# event per server per interval, routed through manager.user_servers
+PRESENCE_BATCH_INTERVAL = float(os.environ.get('PRESENCE_BATCH_INTERVAL_MS', '250')) / 1000
+
+class PresenceBatcher:
+    def __init__(self, interval: float = PRESENCE_BATCH_INTERVAL):
+        self.interval = interval
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"updates": 0, "debounced": 0, "batches": 0}
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def update(self, user_id: str, presence: Dict[str, Any]):
+        self.stats["updates"] += 1
+        if user_id in self.pending:
+            self.stats["debounced"] += 1
+        self.pending[user_id] = presence
+        self.wakeup.set()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        by_server: Dict[str, List[Dict[str, Any]]] = {}
+        for user_id, presence in pending.items():
+            update = {"user_id": user_id, "presence": presence}
+            for server_id in manager.user_servers.get(user_id, ()):
+                by_server.setdefault(server_id, []).append(update)
+        for server_id, updates in by_server.items():
+            await manager.broadcast_to_server(
+                encode_event("presence_batch", {"server_id": server_id, "updates": updates}),
+                server_id
+            )
+            self.stats["batches"] += 1
+
+    async def _run(self):
+        while True:
+            self.wakeup.clear()
+            await self.wakeup.wait()
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+presence_batcher = PresenceBatcher()
+
+# Typing indicator configuration
+TYPING_BROADCAST_INTERVAL = float(os.environ.get('TYPING_BROADCAST_INTERVAL_MS', '500')) / 1000
+TYPING_TTL = float(os.environ.get('TYPING_TTL', '6'))
+
+# Tracks who is typing in each channel and sends at most one coalesced
+# "typing_users" event per channel per interval. Repeated typing frames only
+# refresh the expiry, and a start/stop pair inside one interval that leaves
+# the set unchanged is never broadcast. Each worker reports the typers it
+# knows about, tagged with its NODE_ID, and clients merge the lists by node.
+class TypingAggregator:
+    def __init__(self, interval: float = TYPING_BROADCAST_INTERVAL, ttl: float = TYPING_TTL):
+        self.interval = interval
+        self.ttl = ttl
+        # channel_id -> {user_id: (username, expires_at)}
+        self.typing: Dict[str, Dict[str, tuple]] = {}
+        self.user_channels: Dict[str, set] = {}
+        self.last_sent: Dict[str, frozenset] = {}
+        self.dirty: set = set()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"frames": 0, "suppressed": 0, "broadcasts": 0, "expired": 0}
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def start_typing(self, channel_id: str, user_id: str, username: str):
+        self.stats["frames"] += 1
+        users = self.typing.setdefault(channel_id, {})
+        if user_id in users:
+            self.stats["suppressed"] += 1
+        else:
+            self.dirty.add(channel_id)
+            self.user_channels.setdefault(user_id, set()).add(channel_id)
+            self.wakeup.set()
+        users[user_id] = (username, time.monotonic() + self.ttl)
+
+    def stop_typing(self, channel_id: str, user_id: str):
+        self.stats["frames"] += 1
+        if not self._remove(channel_id, user_id):
+            self.stats["suppressed"] += 1
+
+    def clear_user(self, user_id: str):
+        for channel_id in list(self.user_channels.get(user_id, ())):
+            self._remove(channel_id, user_id)
+
+    def _remove(self, channel_id: str, user_id: str) -> bool:
+        users = self.typing.get(channel_id)
+        if not users or user_id not in users:
+            return False
+        del users[user_id]
+        channels = self.user_channels.get(user_id)
+        if channels:
+            channels.discard(channel_id)
+            if not channels:
+                del self.user_channels[user_id]
+        self.dirty.add(channel_id)
+        self.wakeup.set()
+        return True
+
+    def _expire(self):
+        now = time.monotonic()
+        for channel_id, users in list(self.typing.items()):
+            for user_id, (_, expires_at) in list(users.items()):
+                if expires_at < now:
+                    self._remove(channel_id, user_id)
+                    self.stats["expired"] += 1
+
+    async def flush(self):
+        self._expire()
+        dirty, self.dirty = self.dirty, set()
+        for channel_id in dirty:
+            users = self.typing.get(channel_id, {})
+            current = frozenset(users)
+            if current == self.last_sent.get(channel_id, frozenset()):
+                # Everything that happened since the last update cancelled out
+                self.stats["suppressed"] += 1
+            else:
+                await manager.broadcast_to_channel(
+                    encode_event("typing_users", {
+                        "channel_id": channel_id,
+                        "node": NODE_ID,
+                        "users": [{"user_id": uid, "username": entry[0]} for uid, entry in users.items()]
+                    }),
+                    channel_id,
+                    coalesce_key=f"typing:{channel_id}:{NODE_ID}"
+                )
+                self.stats["broadcasts"] += 1
+            if users:
+                self.last_sent[channel_id] = current
+            else:
+                self.typing.pop(channel_id, None)
+                self.last_sent.pop(channel_id, None)
+
+    async def _run(self):
+        while True:
+            if not self.typing and not self.dirty:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+typing_aggregator = TypingAggregator()
+
+# Reactions are stored as per-emoji counters plus a capped sample of reactors
+# on the message, with one message_reactions document per (message, emoji,
+# user) acting as the per-user set. The unique index on that collection makes
+# add/remove idempotent, and each change is a single atomic $inc.
+REACTION_SAMPLE_SIZE = int(os.environ.get('REACTION_SAMPLE_SIZE', '10'))
+REACTION_EMOJI_MAX_LENGTH = 32
+
+def validate_emoji(emoji: str):
+    # Emoji are used as field names in reaction_counts/reaction_samples
+    if not emoji or len(emoji) > REACTION_EMOJI_MAX_LENGTH or "." in emoji or "$" in emoji:
+        raise HTTPException(status_code=400, detail="Invalid emoji")
+
+async def update_reaction_counter(message_id: str, emoji: str, user: dict, delta: int) -> Optional[dict]:
+    if delta > 0:
+        update = {
+            "$inc": {f"reaction_counts.{emoji}": 1},
+            "$push": {f"reaction_samples.{emoji}": {
+                "$each": [{"user_id": user["user_id"], "username": user["username"]}],
+                "$slice": REACTION_SAMPLE_SIZE
+            }}
+        }
+    else:
+        update = {
+            "$inc": {f"reaction_counts.{emoji}": -1},
+            "$pull": {f"reaction_samples.{emoji}": {"user_id": user["user_id"]}}
+        }
+    return await db.messages.find_one_and_update(
+        {"message_id": message_id},
+        update,
+        projection={"_id": 0, "channel_id": 1, f"reaction_counts.{emoji}": 1, f"reaction_samples.{emoji}": 1},
+        return_document=ReturnDocument.AFTER
+    )
+
+# Messages from before the counters carry a `reactions` array of
+# {emoji, user_id, username}. Converts each entry into a message_reactions
+# marker, recounts the touched emoji from the markers (so a rerun after a
+# partial pass neither double counts nor loses entries) and drops the array.
+async def backfill_reactions() -> int:
+    migrated = 0
+    async for message in db.messages.find(
+        {"reactions": {"$exists": True}},
+        {"_id": 0, "message_id": 1, "reactions": 1, "reaction_samples": 1}
+    ):
+        message_id = message["message_id"]
+        samples = message.get("reaction_samples") or {}
+        touched = set()
+        for reaction in message.get("reactions") or []:
+            emoji, user_id = reaction.get("emoji"), reaction.get("user_id")
+            try:
+                validate_emoji(emoji)
+            except HTTPException:
+                continue
+            if not user_id:
+                continue
+            touched.add(emoji)
+            try:
+                await db.message_reactions.insert_one({"message_id": message_id, "emoji": emoji, "user_id": user_id})
+            except DuplicateKeyError:
+                # Listed twice, or migrated by an earlier run
+                continue
+            sample = samples.setdefault(emoji, [])
+            if len(sample) < REACTION_SAMPLE_SIZE and all(s["user_id"] != user_id for s in sample):
+                sample.append({"user_id": user_id, "username": reaction.get("username")})
+        
+        update: Dict[str, Any] = {"$unset": {"reactions": ""}}
+        if touched:
+            update["$set"] = {}
+            for emoji in touched:
+                update["$set"][f"reaction_counts.{emoji}"] = await db.message_reactions.count_documents(
+                    {"message_id": message_id, "emoji": emoji})
+                update["$set"][f"reaction_samples.{emoji}"] = samples.get(emoji, [])
+        await db.messages.update_one({"message_id": message_id}, update)
+        migrated += 1
+    return migrated
+
+# Message history pagination. Pages are keyset-based on (created_at, message_id)
+# and served by the (channel_id, created_at, message_id) index, so fetching a
+# page deep in history costs the same as fetching the latest one.
+MESSAGE_PAGE_MAX = 100
+MESSAGE_LIST_PROJECTION = {"_id": 0, "replies": 0}
+
+def encode_cursor(message: dict) -> str:
+    raw = json.dumps([message["created_at"], message["message_id"]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, message_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return str(created_at), str(message_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(channel_id: str, cursor: str, op: str) -> dict:
+    created_at, message_id = decode_cursor(cursor)
+    return {
+        "channel_id": channel_id,
+        "$or": [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "message_id": {op: message_id}}
+        ]
+    }
+
+async def fetch_message_page(channel_id: str, limit: int = 50, before: Optional[str] = None,
+                             after: Optional[str] = None) -> dict:
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    limit = max(1, min(limit, MESSAGE_PAGE_MAX))
+
+    if after:
+        query, direction = keyset_filter(channel_id, after, "$gt"), 1
+    elif before:
+        query, direction = keyset_filter(channel_id, before, "$lt"), -1
+    else:
+        query, direction = {"channel_id": channel_id}, -1
+
+    messages = await db.messages.find(query, MESSAGE_LIST_PROJECTION) \
+        .sort([("created_at", direction), ("message_id", direction)]) \
+        .limit(limit + 1).to_list(None)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if direction == -1:
+        messages.reverse()  # Show oldest first
+        has_older, has_newer = has_more, bool(before)
+    else:
+        has_older, has_newer = True, has_more
+
+    return {
+        "messages": messages,
+        "prev_cursor": encode_cursor(messages[0]) if messages and has_older else None,
+        "next_cursor": encode_cursor(messages[-1]) if messages and has_newer else None
+    }
+
+# Message search configuration
+SEARCH_PAGE_MAX = int(os.environ.get('SEARCH_PAGE_MAX', '50'))
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', '1000'))
+SEARCH_QUERY_MAX_LENGTH = 256
+SEARCH_LANGUAGE = os.environ.get('SEARCH_LANGUAGE', 'english')
+SEARCH_PROJECTION = {"_id": 0, "replies": 0, "score": {"$meta": "textScore"}}
+SEARCH_SORT = [("score", {"$meta": "textScore"}), ("created_at", DESCENDING), ("message_id", DESCENDING)]
+
+# Ranked results have no stable keyset, so search cursors are offsets capped
+# at SEARCH_MAX_RESULTS
+def encode_search_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(str(offset).encode('ascii')).decode('ascii').rstrip("=")
+
+def decode_search_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = int(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
+
+def _parse_search_date(value: Optional[str], name: str) -> Optional[str]:
+    if value is None:
+        return None
+    try:
+        # created_at is stored as an ISO string, so compare in the same form
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} date")
+
+# The messages text index is prefixed with server_id, so every search reads
+# only the postings of one server instead of the whole collection
+def search_filter(server_id: str, query: str, author_id: Optional[str] = None,
+                  channel_id: Optional[str] = None, since: Optional[str] = None,
+                  until: Optional[str] = None) -> dict:
+    query = query.strip()
+    if not query or len(query) > SEARCH_QUERY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Query must be 1-{SEARCH_QUERY_MAX_LENGTH} characters")
+    search = {"server_id": server_id, "$text": {"$search": query, "$language": SEARCH_LANGUAGE}}
+    if author_id:
+        search["author_id"] = author_id
+    if channel_id:
+        search["channel_id"] = channel_id
+    since, until = _parse_search_date(since, "since"), _parse_search_date(until, "until")
+    if since or until:
+        search["created_at"] = {}
+        if since:
+            search["created_at"]["$gte"] = since
+        if until:
+            search["created_at"]["$lt"] = until
+    return search
+
+async def search_messages(server_id: str, query: str, limit: int = 25, cursor: Optional[str] = None,
+                          **filters) -> dict:
+    limit = max(1, min(limit, SEARCH_PAGE_MAX))
+    offset = decode_search_cursor(cursor) if cursor else 0
+    if offset >= SEARCH_MAX_RESULTS:
+        return {"results": [], "next_cursor": None}
+    limit = min(limit, SEARCH_MAX_RESULTS - offset)
+
+    results = await db.messages.find(search_filter(server_id, query, **filters), SEARCH_PROJECTION) \
+        .sort(SEARCH_SORT).skip(offset).limit(limit + 1).to_list(None)
+    has_more = len(results) > limit and offset + limit < SEARCH_MAX_RESULTS
+    results = results[:limit]
+    return {
+        "results": results,
+        "next_cursor": encode_search_cursor(offset + limit) if has_more else None
+    }
+
+# Messages written before server_id was stored on them are invisible to the
+# server-scoped text index; stamp them one channel at a time
+async def backfill_message_servers() -> int:
+    updated = 0
+    async for channel in db.channels.find({}, {"_id": 0, "channel_id": 1, "server_id": 1}):
+        result = await db.messages.update_many(
+            {"channel_id": channel["channel_id"], "server_id": {"$exists": False}},
+            {"$set": {"server_id": channel["server_id"]}}
+        )
+        updated += result.modified_count
+    return updated
+
+# Sidebar listing configuration
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', '100'))
+LIST_PAGE_MAX = int(os.environ.get('LIST_PAGE_MAX', '200'))
+# Summaries leave out the members arrays (and the role member lists), which
+# grow with the server; those are served by the members endpoint instead
+SERVER_SUMMARY_PROJECTION = {
+    "_id": 0, "server_id": 1, "name": 1, "description": 1, "icon": 1, "owner_id": 1,
+    "created_at": 1, "channels": 1,
+    "roles.role_id": 1, "roles.name": 1, "roles.color": 1, "roles.permissions": 1,
+    "member_count": {"$size": {"$ifNull": ["$members", []]}}
+}
+CHANNEL_SUMMARY_PROJECTION = {"_id": 0, "messages": 0}
+MEMBER_PROJECTION = {"_id": 0, "user_id": 1, "username": 1, "display_name": 1, "avatar": 1, "custom_status": 1}
+
+def encode_list_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip("=")
+
+def decode_list_cursor(cursor: str, size: int) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def list_page_size(limit: Optional[int]) -> int:
+    return max(1, min(limit or LIST_PAGE_SIZE, LIST_PAGE_MAX))
+
+# Serializes once and answers If-None-Match with 304, so an unchanged sidebar
+# costs a header round-trip instead of the whole listing
+def etag_response(request: Request, payload: dict) -> Response:
+    if orjson is not None:
+        body = orjson.dumps(payload, default=_json_default)
+    else:
+        body = json.dumps(payload, default=_json_default, separators=(',', ':')).encode('utf-8')
+    etag = f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Hot-channel history buffer configuration
+HISTORY_BUFFER_SIZE = int(os.environ.get('HISTORY_BUFFER_SIZE', '100'))
+HISTORY_BUFFER_CHANNELS = int(os.environ.get('HISTORY_BUFFER_CHANNELS', '5000'))
+
+def project_message(message: dict) -> dict:
+    return {k: v for k, v in message.items() if k not in MESSAGE_LIST_PROJECTION}
+
+class ChannelHistory:
+    def __init__(self, messages: List[dict], has_older: bool, size: int):
+        self.messages: deque = deque(messages, maxlen=size)
+        self.has_older = has_older
+
+# The last HISTORY_BUFFER_SIZE messages of recently used channels, so the
+# first page of history is served from memory. create_message and reactions
+# write through; misses fill lazily from Mongo; the least recently used
+# channels are evicted beyond HISTORY_BUFFER_CHANNELS.
+class RecentMessageBuffer:
+    def __init__(self, size: int = HISTORY_BUFFER_SIZE, max_channels: int = HISTORY_BUFFER_CHANNELS):
+        self.size = size
+        self.max_channels = max_channels
+        self.channels: "OrderedDict[str, ChannelHistory]" = OrderedDict()
+        # channel_id -> True if a write landed while a fill was in flight
+        self.filling: Dict[str, bool] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def first_page(self, channel_id: str, limit: int) -> dict:
+        limit = max(1, min(limit, MESSAGE_PAGE_MAX))
+        history = self.channels.get(channel_id)
+        if history is None or limit > self.size:
+            self.misses += 1
+            if limit > self.size:
+                return await fetch_message_page(channel_id, limit)
+            history = await self._fill(channel_id)
+            if history is None:
+                return await fetch_message_page(channel_id, limit)
+        else:
+            self.hits += 1
+            self.channels.move_to_end(channel_id)
+
+        messages = list(history.messages)
+        has_older = history.has_older or len(messages) > limit
+        messages = messages[-limit:]
+        return {
+            "messages": messages,
+            "prev_cursor": encode_cursor(messages[0]) if messages and has_older else None,
+            "next_cursor": None
+        }
+
+    async def _fill(self, channel_id: str) -> Optional[ChannelHistory]:
+        if channel_id in self.filling:
+            return None
+        self.filling[channel_id] = False
+        try:
+            page = await fetch_message_page(channel_id, self.size)
+        finally:
+            dirty = self.filling.pop(channel_id)
+        if dirty or (MESSAGE_WRITE_BEHIND and message_writer.pending_for(channel_id)):
+            # A message arrived mid-query or is not written yet; don't cache a
+            # page that may miss it
+            return None
+        history = ChannelHistory(page["messages"], page["prev_cursor"] is not None, self.size)
+        self.channels[channel_id] = history
+        while len(self.channels) > self.max_channels:
+            self.channels.popitem(last=False)
+        return history
+
+    def append(self, message: dict):
+        channel_id = message["channel_id"]
+        if channel_id in self.filling:
+            self.filling[channel_id] = True
+        history = self.channels.get(channel_id)
+        if history is None:
+            return
+        if len(history.messages) == history.messages.maxlen:
+            history.has_older = True
+        history.messages.append(project_message(message))
+
+    def update(self, channel_id: str, message_id: str, apply: Callable[[dict], None]):
+        history = self.channels.get(channel_id)
+        if history is None:
+            return
+        for message in reversed(history.messages):
+            if message["message_id"] == message_id:
+                apply(message)
+                return
+
+    def invalidate(self, channel_id: str):
+        self.channels.pop(channel_id, None)
+
+    # Writes go out over the broadcast bus and every worker, including this
+    # one, applies them in deliver(); otherwise only the worker that took the
+    # write would see it and the rest would serve a stale first page
+    async def publish_append(self, message: dict):
+        await manager.bus.publish("history_append", message["channel_id"], encode_event("history_append", message))
+
+    # Carries the stored sample as well as the count, so buffered pages show
+    # the same reactors a Mongo read would without replaying $push/$slice
+    async def publish_reaction(self, channel_id: str, message_id: str, emoji: str, count: int, sample: list):
+        await manager.bus.publish("history_reaction", channel_id, encode_event("history_reaction", {
+            "message_id": message_id, "emoji": emoji, "count": count, "sample": sample
+        }))
+
+    def apply_append(self, channel_id: str, frame: str):
+        self.append(json.loads(frame)["data"])
+
+    def apply_reaction(self, channel_id: str, frame: str):
+        data = json.loads(frame)["data"]
+
+        def apply(buffered: dict):
+            buffered["reaction_counts"] = {**buffered.get("reaction_counts", {}), data["emoji"]: data["count"]}
+            buffered["reaction_samples"] = {**buffered.get("reaction_samples", {}), data["emoji"]: data["sample"]}
+        self.update(channel_id, data["message_id"], apply)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"size": len(self.channels), "hits": self.hits, "misses": self.misses}
+
+recent_messages = RecentMessageBuffer()
+manager.control_handlers["history_append"] = recent_messages.apply_append
+manager.control_handlers["history_reaction"] = recent_messages.apply_reaction
+manager.control_handlers["history_invalidate"] = lambda channel_id, _: recent_messages.invalidate(channel_id)
+
+# Write-behind configuration for message inserts
+MESSAGE_WRITE_BEHIND = os.environ.get('MESSAGE_WRITE_BEHIND', 'false').lower() == 'true'
+MESSAGE_BATCH_SIZE = int(os.environ.get('MESSAGE_BATCH_SIZE', '500'))
+MESSAGE_BATCH_INTERVAL = float(os.environ.get('MESSAGE_BATCH_INTERVAL_MS', '20')) / 1000
+MESSAGE_WRITE_ACK = os.environ.get('MESSAGE_WRITE_ACK', 'accepted')  # accepted, persisted
+
+# Groups message inserts from a short time/size window into one unordered
+# insert_many. With ack "accepted" create_message returns as soon as the
+# message is queued; with "persisted" it waits for its batch to be written.
+# Either way the message is broadcast on acceptance.
+class MessageWriteBehind:
+    def __init__(self, batch_size: int = MESSAGE_BATCH_SIZE, interval: float = MESSAGE_BATCH_INTERVAL,
+                 ack: str = MESSAGE_WRITE_ACK):
+        if ack not in ("accepted", "persisted"):
+            raise ValueError(f"Unknown write acknowledgement mode: {ack}")
+        self.batch_size = batch_size
+        self.interval = interval
+        self.ack = ack
+        self.pending: List[tuple] = []
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closing = False
+        self.stats: Dict[str, int] = {"batches": 0, "inserted": 0, "failed": 0}
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def submit(self, message: dict) -> Optional[asyncio.Future]:
+        future = asyncio.get_running_loop().create_future() if self.ack == "persisted" else None
+        self.pending.append((message, future))
+        self.wakeup.set()
+        return future
+
+    def pending_for(self, channel_id: str) -> bool:
+        return any(message["channel_id"] == channel_id for message, _ in self.pending)
+
+    async def _run(self):
+        while not self.closing:
+            await self.wakeup.wait()
+            if len(self.pending) < self.batch_size and not self.closing:
+                await asyncio.sleep(self.interval)
+            self.wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self.pending:
+            batch = self.pending[:self.batch_size]
+            del self.pending[:self.batch_size]
+            failed: Dict[int, Exception] = {}
+            try:
+                await db.messages.insert_many([message for message, _ in batch], ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    failed[error["index"]] = e
+            except PyMongoError as e:
+                failed = {index: e for index in range(len(batch))}
+            self.stats["batches"] += 1
+            self.stats["inserted"] += len(batch) - len(failed)
+            self.stats["failed"] += len(failed)
+            if failed:
+                logger.error("Write-behind batch lost %d of %d messages", len(failed), len(batch))
+            for index, (_, future) in enumerate(batch):
+                if future is None or future.done():
+                    continue
+                if index in failed:
+                    future.set_exception(failed[index])
+                else:
+                    future.set_result(None)
+            if failed:
+                await self.retract([batch[index][0] for index in failed])
+
+    async def retract(self, messages: List[dict]):
+        # These were broadcast and buffered on acceptance but never stored:
+        # drop the buffered pages everywhere and take them back from clients
+        for channel_id in {message["channel_id"] for message in messages}:
+            await manager.bus.publish("history_invalidate", channel_id, "")
+        for message in messages:
+            await manager.broadcast_to_channel(
+                encode_event("message_deleted", {
+                    "message_id": message["message_id"],
+                    "channel_id": message["channel_id"],
+                    "reason": "not_persisted"
+                }),
+                message["channel_id"]
+            )
+
+    async def close(self):
+        # Let the writer finish the batch it may be inserting rather than
+        # cancelling it mid insert_many and leaving its futures unresolved
+        if self.task:
+            self.closing = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+        await self.flush()
+
+message_writer = MessageWriteBehind()
+
+# Index bootstrap. Every handler query must be covered by one of these; run
+# `python server.py --check-indexes` to explain() each query in HANDLER_QUERIES
+# and fail if any of them would fall back to a collection scan.
+INDEXES: Dict[str, List[Dict[str, Any]]] = {
+    "users": [
+        {"keys": [("user_id", ASCENDING)], "name": "user_id", "unique": True},
+        {"keys": [("username", ASCENDING)], "name": "username", "unique": True},
+        {"keys": [("email", ASCENDING)], "name": "email", "unique": True},
+    ],
+    "servers": [
+        {"keys": [("server_id", ASCENDING)], "name": "server_id", "unique": True},
+        {"keys": [("members", ASCENDING), ("server_id", ASCENDING)], "name": "members_server_id"},
+    ],
+    "channels": [
+        {"keys": [("channel_id", ASCENDING)], "name": "channel_id", "unique": True},
+        {"keys": [("server_id", ASCENDING), ("position", ASCENDING), ("channel_id", ASCENDING)],
+         "name": "server_position"},
+    ],
+    "replay_events": [
+        {"keys": [("server_id", ASCENDING), ("epoch", ASCENDING), ("seq", ASCENDING)], "name": "server_epoch_seq"},
+        {"keys": [("created_at", ASCENDING)], "name": "created_at_ttl", "expireAfterSeconds": REPLAY_SPILL_TTL},
+    ],
+    "refresh_tokens": [
+        {"keys": [("jti", ASCENDING)], "name": "jti", "unique": True},
+        {"keys": [("user_id", ASCENDING)], "name": "user_id"},
+        {"keys": [("expires_at", ASCENDING)], "name": "expires_at_ttl", "expireAfterSeconds": 0},
+    ],
+    "revoked_tokens": [
+        {"keys": [("jti", ASCENDING)], "name": "jti", "unique": True},
+        {"keys": [("revoked_at", ASCENDING)], "name": "revoked_at"},
+        {"keys": [("expires_at", ASCENDING)], "name": "expires_at_ttl", "expireAfterSeconds": 0},
+    ],
+    "message_reactions": [
+        {"keys": [("message_id", ASCENDING), ("emoji", ASCENDING), ("user_id", ASCENDING)],
+         "name": "message_emoji_user", "unique": True},
+    ],
+    "messages": [
+        {"keys": [("message_id", ASCENDING)], "name": "message_id", "unique": True},
+        {"keys": [("channel_id", ASCENDING), ("created_at", DESCENDING), ("message_id", DESCENDING)],
+         "name": "channel_history"},
+        {"keys": [("server_id", ASCENDING), ("content", "text")], "name": "server_content_text",
+         "default_language": SEARCH_LANGUAGE},
+    ],
+}
+
+_SAMPLE_CURSOR = encode_cursor({"created_at": "2025-01-01T00:00:00", "message_id": "sample"})
+HANDLER_QUERIES: List[Dict[str, Any]] = [
+    {"handler": "get_current_user", "collection": "users", "filter": {"user_id": "sample"}},
+    {"handler": "login", "collection": "users", "filter": {"username": "sample"}},
+    {"handler": "register", "collection": "users",
+     "filter": {"$or": [{"username": "sample"}, {"email": "sample"}]}},
+    {"handler": "get_user_servers", "collection": "servers",
+     "filter": {"members": "sample", "server_id": {"$gt": "sample"}}, "sort": [("server_id", ASCENDING)]},
+    {"handler": "create_channel", "collection": "servers", "filter": {"server_id": "sample", "members": "sample"}},
+    {"handler": "topology.get_server_members", "collection": "servers", "filter": {"server_id": "sample"}},
+    {"handler": "topology.get_channel_server", "collection": "channels", "filter": {"channel_id": "sample"}},
+    {"handler": "authorizer.load", "collection": "servers", "filter": {"members": "sample"}},
+    {"handler": "authorizer.load", "collection": "channels", "filter": {"server_id": {"$in": ["sample"]}}},
+    {"handler": "get_server_channels", "collection": "channels", "filter": {"server_id": "sample"},
+     "sort": [("position", ASCENDING), ("channel_id", ASCENDING)]},
+    {"handler": "resume", "collection": "replay_events",
+     "filter": {"server_id": "sample", "epoch": "sample", "seq": {"$gt": 0, "$lt": 10}},
+     "sort": [("seq", ASCENDING)]},
+    {"handler": "refresh_token", "collection": "refresh_tokens", "filter": {"jti": "sample", "revoked": False}},
+    {"handler": "refresh_token(reuse)", "collection": "refresh_tokens", "filter": {"user_id": "sample"}},
+    {"handler": "token_service.is_revoked", "collection": "revoked_tokens", "filter": {"jti": "sample"}},
+    {"handler": "token_service.sync", "collection": "revoked_tokens",
+     "filter": {"revoked_at": {"$gte": datetime(2025, 1, 1)}}},
+    {"handler": "add_reaction", "collection": "messages", "filter": {"message_id": "sample"}},
+    {"handler": "add_reaction", "collection": "message_reactions",
+     "filter": {"message_id": "sample", "emoji": "sample", "user_id": "sample"}},
+    {"handler": "get_channel_messages", "collection": "messages", "filter": {"channel_id": "sample"},
+     "sort": [("created_at", DESCENDING), ("message_id", DESCENDING)]},
+    {"handler": "get_channel_messages(before)", "collection": "messages",
+     "filter": keyset_filter("sample", _SAMPLE_CURSOR, "$lt"),
+     "sort": [("created_at", DESCENDING), ("message_id", DESCENDING)]},
+    {"handler": "search_server_messages", "collection": "messages",
+     "filter": search_filter("sample", "sample", channel_id="sample")},
+]
+
+async def ensure_indexes() -> List[str]:
+    failures = []
+    specs = [(collection, spec) for collection, specs in INDEXES.items() for spec in specs]
+    for position, (collection, spec) in enumerate(specs, 1):
+        options = {k: v for k, v in spec.items() if k != "keys"}
+        started = time.perf_counter()
+        try:
+            await db[collection].create_index(spec["keys"], **options)
+        except OperationFailure as e:
+            # e.g. duplicate usernames already stored; keep booting and report it
+            failures.append(f"{collection}.{spec['name']}: {e}")
+            logger.error("Index %s.%s failed: %s", collection, spec["name"], e)
+            continue
+        logger.info("Index %d/%d %s.%s ready in %.0f ms", position, len(specs), collection,
+                    spec["name"], (time.perf_counter() - started) * 1000)
+    return failures
+
+def _plan_stages(plan: Dict[str, Any]):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+async def find_collection_scans() -> List[str]:
+    scans = []
+    for query in HANDLER_QUERIES:
+        cursor = db[query["collection"]].find(query["filter"])
+        if "sort" in query:
+            cursor = cursor.sort(query["sort"])
+        explain = await cursor.limit(1).explain()
+        stages = set(_plan_stages(explain["queryPlanner"]["winningPlan"]))
+        if "COLLSCAN" in stages:
+            scans.append(f"{query['handler']} on {query['collection']}: {query['filter']}")
+    return scans
+
+async def check_indexes() -> int:
+    failures = await ensure_indexes()
+    scans = await find_collection_scans()
+    for line in failures:
+        print(f"❌ Index build failed: {line}")
+    for line in scans:
+        print(f"❌ COLLSCAN: {line}")
+    if not failures and not scans:
+        print(f"✅ {len(HANDLER_QUERIES)} handler queries are index-backed")
+    return 1 if failures or scans else 0
+
+# Password hashing configuration
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', str(min(4, os.cpu_count() or 1))))
+BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', '64'))
+
 # Authentication helpers
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
-def create_access_token(data: dict) -> str:
-    return jwt.encode(data, JWT_SECRET, algorithm=JWT_ALGORITHM)
+# Runs bcrypt on a small dedicated thread pool (bcrypt releases the GIL) so
+# register/login never block the event loop. Once max_pending jobs are queued
+# or running, new requests are rejected with 429 instead of piling up.
+class PasswordHasher:
+    def __init__(self, workers: int = BCRYPT_WORKERS, max_pending: int = BCRYPT_MAX_PENDING,
+                 rounds: int = BCRYPT_ROUNDS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.pending = 0
+        self.rejected = 0
 
-def verify_token(token: str) -> dict:
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many authentication requests, please retry",
+                headers={"Retry-After": "1"}
+            )
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+            # Includes time queued behind other jobs, which is what a login waits for
+            BCRYPT_LATENCY.observe(time.perf_counter() - started, fn.__name__)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password, self.rounds)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+password_hasher = PasswordHasher()
+
+# Rate limiting configuration. RATE_LIMITS overrides rules as
+# "route=rate/burst,..." where rate is tokens per second.
+RATE_LIMIT_POLICY = os.environ.get('RATE_LIMIT_POLICY', 'reject')  # reject, delay, disconnect
+RATE_LIMIT_POLICIES = ("reject", "delay", "disconnect")
+RATE_LIMIT_MAX_DELAY = float(os.environ.get('RATE_LIMIT_MAX_DELAY', '2'))
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # memory, redis
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '200000'))
+RATE_LIMIT_RULES: Dict[str, tuple] = {
+    "messages": (5.0, 10),
+    "reactions": (10.0, 20),
+    "ws_frame": (20.0, 40),  # every inbound frame on one connection
+    "typing": (2.0, 4),
+    "presence_update": (1.0, 3),
+    "join_server": (5.0, 10),
+}
+
+def parse_rate_limits(spec: str) -> Dict[str, tuple]:
+    rules = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        rules[route.strip()] = (float(rate), int(burst) if burst else max(1, int(float(rate))))
+    return rules
+
+RATE_LIMIT_RULES.update(parse_rate_limits(os.environ.get('RATE_LIMITS', '')))
+
+# In-process token buckets, cheap enough to consult on every WebSocket frame.
+# Buckets are [tokens, updated_at, rate, burst]; a full bucket carries no
+# state, so those are the first to go when the key limit is reached.
+class RateLimiter:
+    def __init__(self, rules: Dict[str, tuple] = RATE_LIMIT_RULES, policy: str = RATE_LIMIT_POLICY,
+                 max_delay: float = RATE_LIMIT_MAX_DELAY, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        if policy not in RATE_LIMIT_POLICIES:
+            raise ValueError(f"Unknown rate limit policy: {policy}")
+        self.rules = rules
+        self.policy = policy
+        self.max_delay = max_delay
+        self.max_keys = max_keys
+        self.buckets: Dict[tuple, list] = {}
+        self.stats = {"allowed": 0, "delayed": 0, "rejected": 0, "disconnected": 0}
+
+    # Returns 0 when allowed, otherwise the seconds until a token is free. Under
+    # the delay policy a wait within max_delay reserves the token, so the
+    # caller sleeps and proceeds; any other non-zero result means refuse.
+    def take(self, route: str, key: str) -> float:
+        rule = self.rules.get(route)
+        if rule is None:
+            return 0.0
+        rate, burst = rule
+        now = time.monotonic()
+        bucket = self.buckets.get((route, key))
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self.buckets[(route, key)] = [float(burst), now, rate, burst]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        tokens = bucket[0] - 1
+        if tokens >= 0:
+            bucket[0] = tokens
+            return 0.0
+        wait = -tokens / rate
+        if self.policy == "delay" and wait <= self.max_delay:
+            bucket[0] = tokens
+        return wait
+
+    async def acquire(self, route: str, key: str) -> float:
+        return self.take(route, key)
+
+    def _prune(self, now: float):
+        full = [k for k, (tokens, updated, rate, burst) in self.buckets.items()
+                if tokens + (now - updated) * rate >= burst]
+        for k in full:
+            del self.buckets[k]
+        if len(self.buckets) >= self.max_keys:
+            # Everyone is mid-burst; failing open beats growing without bound
+            self.buckets.clear()
+
+    def delays(self, wait: float) -> bool:
+        return self.policy == "delay" and wait <= self.max_delay
+
+    async def limit_http(self, route: str, key: str):
+        wait = await self.acquire(route, key)
+        if not wait:
+            self.stats["allowed"] += 1
+            return
+        if self.delays(wait):
+            self.stats["delayed"] += 1
+            await asyncio.sleep(wait)
+            return
+        self.stats["rejected"] += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(int(wait) + 1)}
+        )
+
+    async def close(self):
+        pass
+
+# Shares HTTP buckets between workers so a user cannot multiply their limit
+# by spreading requests across processes. WebSocket frames keep using the
+# local buckets: a connection lives on exactly one worker.
+class RedisRateLimiter(RateLimiter):
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local max_delay = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = clock[1] + clock[2] / 1000000
+local state = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate) - 1
+local wait = 0
+if tokens < 0 then
+    wait = -tokens / rate
+    if wait > max_delay then
+        tokens = tokens + 1
+    end
+end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, url: str = REDIS_URL, **kwargs):
+        if aioredis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package")
+        super().__init__(**kwargs)
+        self.redis = aioredis.from_url(url, decode_responses=True)
+
+    async def acquire(self, route: str, key: str) -> float:
+        rule = self.rules.get(route)
+        if rule is None:
+            return 0.0
+        rate, burst = rule
+        max_delay = self.max_delay if self.policy == "delay" else 0
+        try:
+            wait = await self.redis.eval(self.SCRIPT, 1, f"ratelimit:{route}:{key}", rate, burst, max_delay)
+        except Exception as e:
+            logger.warning("Shared rate limiter unavailable, using local buckets: %s", e)
+            return self.take(route, key)
+        return float(wait)
+
+    async def close(self):
+        await self.redis.aclose()
+
+rate_limiter = RedisRateLimiter() if RATE_LIMIT_BACKEND == "redis" else RateLimiter()
+
+# Token configuration
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '100000'))
+REVOCATION_BLOOM_BITS = int(os.environ.get('REVOCATION_BLOOM_BITS', str(1 << 20)))
+REVOCATION_BLOOM_HASHES = int(os.environ.get('REVOCATION_BLOOM_HASHES', '7'))
+REVOCATION_SYNC_INTERVAL = float(os.environ.get('REVOCATION_SYNC_INTERVAL', '5'))
+REVOCATION_REBUILD_INTERVAL = float(os.environ.get('REVOCATION_REBUILD_INTERVAL', '3600'))
+
+# Fixed-size set membership with false positives but no false negatives.
+# Positions come from one blake2b digest split into two halves (double hashing).
+class BloomFilter:
+    def __init__(self, bits: int = REVOCATION_BLOOM_BITS, hashes: int = REVOCATION_BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        array = self.array
+        return all(array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+# Short-lived access JWTs plus rotating refresh tokens stored in Mongo.
+# Verified access claims are cached per token string, so a repeat request
+# costs a dict lookup, an expiry compare and a bloom-filter probe instead of
+# an HMAC check. Revoked jtis live in revoked_tokens (TTL-expired at the
+# token's own exp) and are mirrored into the bloom filter by polling, which
+# keeps every worker within REVOCATION_SYNC_INTERVAL of a logout. A bloom
+# hit is confirmed against Mongo, so false positives only cost a lookup.
+class TokenService:
+    def __init__(self, secret: str = JWT_SECRET, access_ttl: int = ACCESS_TOKEN_TTL,
+                 refresh_ttl: int = REFRESH_TOKEN_TTL, cache_size: int = TOKEN_CACHE_SIZE):
+        self.secret = secret
+        self.access_ttl = access_ttl
+        self.refresh_ttl = refresh_ttl
+        self.claims = TTLCache(cache_size, access_ttl)
+        self.revoked = BloomFilter()
+        self.confirmed = TTLCache(10000, 60)
+        self.synced_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"issued": 0, "refreshed": 0, "decoded": 0, "rejected": 0, "revoked": 0,
+                      "bloom_hits": 0, "bloom_false_positives": 0, "refresh_reuse": 0}
+
+    def _encode(self, claims: dict) -> str:
+        return jwt.encode(claims, self.secret, algorithm=JWT_ALGORITHM)
+
+    def issue_access(self, user: dict) -> str:
+        now = int(time.time())
+        self.stats["issued"] += 1
+        return self._encode({
+            "user_id": user["user_id"],
+            "username": user["username"],
+            "type": "access",
+            "jti": uuid.uuid4().hex,
+            "iat": now,
+            "exp": now + self.access_ttl
+        })
+
+    async def issue_refresh(self, user_id: str) -> str:
+        now = int(time.time())
+        jti = uuid.uuid4().hex
+        await db.refresh_tokens.insert_one({
+            "jti": jti,
+            "user_id": user_id,
+            "revoked": False,
+            "created_at": datetime.utcnow(),
+            "expires_at": datetime.utcfromtimestamp(now + self.refresh_ttl)
+        })
+        return self._encode({"user_id": user_id, "type": "refresh", "jti": jti, "iat": now,
+                             "exp": now + self.refresh_ttl})
+
+    def decode(self, token: str, token_type: str) -> dict:
+        self.stats["decoded"] += 1
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=[JWT_ALGORITHM], leeway=JWT_LEEWAY,
+                                options={"require": ["exp", "iat", "jti"]})
+        except jwt.ExpiredSignatureError:
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=401, detail="Token has expired")
+        except jwt.InvalidTokenError:
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=401, detail="Invalid token")
+        if claims.get("type") != token_type or "user_id" not in claims:
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return claims
+
+    async def verify_access(self, token: str) -> dict:
+        claims = self.claims.get(token)
+        if claims is None:
+            claims = self.decode(token, "access")
+            self.claims.set(token, claims)
+        elif claims["exp"] + JWT_LEEWAY < time.time():
+            self.claims.invalidate(token)
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=401, detail="Token has expired")
+        if claims["jti"] in self.revoked and await self.is_revoked(claims["jti"]):
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=401, detail="Token has been revoked")
+        return claims
+
+    async def is_revoked(self, jti: str) -> bool:
+        self.stats["bloom_hits"] += 1
+        revoked = self.confirmed.get(jti)
+        if revoked is None:
+            revoked = await db.revoked_tokens.find_one({"jti": jti}, {"_id": 1}) is not None
+            self.confirmed.set(jti, revoked)
+        if not revoked:
+            self.stats["bloom_false_positives"] += 1
+        return revoked
+
+    async def revoke(self, claims: dict):
+        await db.revoked_tokens.update_one(
+            {"jti": claims["jti"]},
+            {"$setOnInsert": {
+                "jti": claims["jti"],
+                "user_id": claims["user_id"],
+                "revoked_at": datetime.utcnow(),
+                "expires_at": datetime.utcfromtimestamp(claims["exp"] + JWT_LEEWAY)
+            }},
+            upsert=True
+        )
+        self.revoked.add(claims["jti"])
+        self.confirmed.set(claims["jti"], True)
+        self.stats["revoked"] += 1
+
+    async def revoke_refresh(self, token: str, user_id: str):
+        claims = self.decode(token, "refresh")
+        if claims["user_id"] == user_id:
+            await db.refresh_tokens.update_one({"jti": claims["jti"]}, {"$set": {"revoked": True}})
+
+    # Single use: a refresh token that was already rotated is being replayed,
+    # so every refresh token of that user is revoked
+    async def rotate(self, token: str) -> str:
+        claims = self.decode(token, "refresh")
+        stored = await db.refresh_tokens.find_one_and_update(
+            {"jti": claims["jti"], "revoked": False},
+            {"$set": {"revoked": True, "rotated_at": datetime.utcnow()}}
+        )
+        if stored is None:
+            if await db.refresh_tokens.find_one({"jti": claims["jti"]}, {"_id": 1}):
+                self.stats["refresh_reuse"] += 1
+                await db.refresh_tokens.update_many({"user_id": claims["user_id"]}, {"$set": {"revoked": True}})
+            raise HTTPException(status_code=401, detail="Invalid refresh token")
+        self.stats["refreshed"] += 1
+        return claims["user_id"]
+
+    async def sync(self):
+        query: Dict[str, Any] = {}
+        if self.synced_at is not None:
+            # Overlap a little: revoked_at comes from other workers' clocks
+            query["revoked_at"] = {"$gte": self.synced_at - timedelta(seconds=30)}
+        started = datetime.utcnow()
+        async for revoked in db.revoked_tokens.find(query, {"_id": 0, "jti": 1}):
+            self.revoked.add(revoked["jti"])
+        self.synced_at = started
+
+    async def rebuild(self):
+        # Bloom filters cannot forget, so start over from the unexpired revocations
+        fresh = BloomFilter(self.revoked.bits, self.revoked.hashes)
+        started = datetime.utcnow()
+        async for revoked in db.revoked_tokens.find({"expires_at": {"$gt": started}}, {"_id": 0, "jti": 1}):
+            fresh.add(revoked["jti"])
+        self.revoked = fresh
+        self.synced_at = started
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        rebuilt_at = 0.0
+        while True:
+            try:
+                if time.monotonic() - rebuilt_at > REVOCATION_REBUILD_INTERVAL:
+                    await self.rebuild()
+                    rebuilt_at = time.monotonic()
+                else:
+                    await self.sync()
+            except PyMongoError as e:
+                logger.warning("Revocation sync failed: %s", e)
+            await asyncio.sleep(REVOCATION_SYNC_INTERVAL)
+
+token_service = TokenService()
+
+async def auth_response(user: dict) -> dict:
+    return {
+        "access_token": token_service.issue_access(user),
+        "refresh_token": await token_service.issue_refresh(user["user_id"]),
+        "token_type": "bearer",
+        "expires_in": token_service.access_ttl,
+        "user": {k: v for k, v in user.items() if k not in ("password", "_id")}
+    }
+
+# WebSocket close codes for a failed handshake; the 4xxx range is ours to define
+WS_CLOSE_UNAUTHORIZED = 4401
+WS_CLOSE_FORBIDDEN = 4403
+WS_FORBIDDEN_FRAMES = metrics.counter("xalvion_ws_forbidden_frames_total",
+                                      "Frames refused by the connection's authorization context", ("frame",))
+
+# What one socket may touch, loaded once at the handshake so frames are
+# checked with a set/dict lookup instead of a membership query each.
+# Membership changes mark it stale (see ConnectionManager.invalidate_authorization)
+# and the connection's own receive loop reloads it before the next check.
+class AuthorizationContext:
+    def __init__(self, claims: dict, servers: set, channels: Dict[str, str]):
+        self.claims = claims
+        self.servers = servers
+        # channel_id -> server_id
+        self.channels = channels
+        self.stale = False
+
+    def can_join(self, server_id: Any) -> bool:
+        return server_id in self.servers
+
+    def channel_server(self, channel_id: Any) -> Optional[str]:
+        return self.channels.get(channel_id) if isinstance(channel_id, str) else None
+
+class Authorizer:
+    def __init__(self):
+        self.stats: Dict[str, int] = {"handshakes": 0, "rejected": 0, "loads": 0, "reloads": 0,
+                                      "invalidations": 0, "revoked_sessions": 0}
+
+    async def authenticate(self, websocket: WebSocket, user_id: str) -> Optional[dict]:
+        # Browsers cannot set headers on a WebSocket, so the token may also come as ?token=
+        self.stats["handshakes"] += 1
+        token = websocket.query_params.get("token")
+        header = websocket.headers.get("authorization", "")
+        if not token and header.lower().startswith("bearer "):
+            token = header[7:]
+        code = WS_CLOSE_UNAUTHORIZED
+        claims = None
+        if token:
+            try:
+                claims = await token_service.verify_access(token)
+            except HTTPException:
+                claims = None
+            if claims is not None and claims["user_id"] != user_id:
+                claims, code = None, WS_CLOSE_FORBIDDEN
+        if claims is None:
+            self.stats["rejected"] += 1
+            # Accept first so the client sees our close code instead of a bare HTTP 403
+            await websocket.accept()
+            await websocket.close(code=code)
+        return claims
+
+    async def load(self, claims: dict) -> AuthorizationContext:
+        self.stats["loads"] += 1
+        servers = {
+            server["server_id"]
+            async for server in db.servers.find({"members": claims["user_id"]}, {"_id": 0, "server_id": 1})
+        }
+        channels = {}
+        if servers:
+            async for channel in db.channels.find({"server_id": {"$in": list(servers)}},
+                                                  {"_id": 0, "channel_id": 1, "server_id": 1}):
+                channels[channel["channel_id"]] = channel["server_id"]
+        return AuthorizationContext(claims, servers, channels)
+
+    async def current(self, connection: "ClientConnection") -> Optional[AuthorizationContext]:
+        # Returns None once the handshake token has been revoked; the access
+        # token's exp is only enforced at the handshake, so reconnects need a fresh one
+        auth = connection.auth
+        jti = auth.claims["jti"]
+        if jti in token_service.revoked and await token_service.is_revoked(jti):
+            self.stats["revoked_sessions"] += 1
+            return None
+        if auth.stale:
+            self.stats["reloads"] += 1
+            auth = connection.auth = await self.load(auth.claims)
+            # Stop delivering servers the user no longer belongs to
+            for server_id in list(connection.manager.user_servers.get(connection.user_id, ())):
+                if server_id not in auth.servers:
+                    connection.manager.leave_server(server_id, connection.user_id)
+        return auth
+
+    def deny(self, connection: "ClientConnection", frame_type: str, target: Any):
+        WS_FORBIDDEN_FRAMES.inc(frame_type)
+        connection.enqueue(encode_event("forbidden", {"type": frame_type, "target": target}),
+                           coalesce_key="forbidden")
+
+    # Membership changes reach every worker through the broadcast bus
+    async def invalidate_user(self, user_id: str):
+        self.stats["invalidations"] += 1
+        await manager.bus.publish("authz_user", user_id, "")
+
+    async def invalidate_server(self, server_id: str):
+        self.stats["invalidations"] += 1
+        await manager.bus.publish("authz_server", server_id, "")
+
+authorizer = Authorizer()
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    payload = verify_token(credentials.credentials)
+    payload = await token_service.verify_access(credentials.credentials)
     user_id = payload.get("user_id")
-    user = await db.users.find_one({"user_id": user_id})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await db.users.find_one({"user_id": user_id}, USER_CACHE_PROJECTION)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_cache.set(user_id, user)
     return user
 
 # API Routes
@@ -158,7 +2467,7 @@ async def register(user_data: UserRegistration):
     
     # Create user
     user_id = str(uuid.uuid4())
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
     
     user = {
         "user_id": user_id,
@@ -177,21 +2486,38 @@ async def register(user_data: UserRegistration):
         "blocked_users": []
     }
     
-    await db.users.insert_one(user)
-    
-    # Create access token
-    token = create_access_token({"user_id": user_id, "username": user_data.username})
+    try:
+        await db.users.insert_one(user)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration; the unique indexes decide
+        raise HTTPException(status_code=400, detail="User already exists")
     
-    return {"access_token": token, "user": {k: v for k, v in user.items() if k != "password"}}
+    return await auth_response(user)
 
 @app.post("/api/auth/login")
 async def login(user_data: UserLogin):
     user = await db.users.find_one({"username": user_data.username})
-    if not user or not verify_password(user_data.password, user["password"]):
+    if not user or not await password_hasher.verify(user_data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    token = create_access_token({"user_id": user["user_id"], "username": user["username"]})
-    return {"access_token": token, "user": {k: v for k, v in user.items() if k != "password"}}
+    return await auth_response(user)
+
+@app.post("/api/auth/refresh")
+async def refresh_token(refresh_data: RefreshRequest):
+    user_id = await token_service.rotate(refresh_data.refresh_token)
+    user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password": 0})
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    return await auth_response(user)
+
+@app.post("/api/auth/logout")
+async def logout(logout_data: Optional[LogoutRequest] = None,
+                 credentials: HTTPAuthorizationCredentials = Depends(security)):
+    claims = await token_service.verify_access(credentials.credentials)
+    await token_service.revoke(claims)
+    if logout_data and logout_data.refresh_token:
+        await token_service.revoke_refresh(logout_data.refresh_token, claims["user_id"])
+    return {"success": True}
 
 @app.get("/api/user/profile")
 async def get_profile(current_user: dict = Depends(get_current_user)):
@@ -233,12 +2559,14 @@ async def create_server(server_data: ServerCreate, current_user: dict = Depends(
     }
     
     await db.servers.insert_one(server)
+    topology.set_server_members(server_id, server["members"])
     
     # Add server to user's server list
     await db.users.update_one(
         {"user_id": current_user["user_id"]},
         {"$push": {"servers": server_id}}
     )
+    invalidate_user(current_user["user_id"])
     
     # Create default channels
     default_channels = [
@@ -261,29 +2589,143 @@ async def create_server(server_data: ServerCreate, current_user: dict = Depends(
         }
         
         await db.channels.insert_one(channel)
+        topology.set_channel(channel_id, server_id)
         server["channels"].append(channel_id)
     
     await db.servers.update_one(
         {"server_id": server_id},
         {"$set": {"channels": server["channels"]}}
     )
+    await authorizer.invalidate_user(current_user["user_id"])
     
-    return server
+    return strip_mongo_id(server)
 
 @app.get("/api/servers")
-async def get_user_servers(current_user: dict = Depends(get_current_user)):
-    servers = await db.servers.find({"members": current_user["user_id"]}).to_list(None)
-    return {"servers": parse_json(servers)}
+async def get_user_servers(request: Request, limit: Optional[int] = None, cursor: Optional[str] = None,
+                           current_user: dict = Depends(get_current_user)):
+    limit = list_page_size(limit)
+    query: Dict[str, Any] = {"members": current_user["user_id"]}
+    if cursor:
+        last_server_id = decode_list_cursor(cursor, 1)[0]
+        if not isinstance(last_server_id, str):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query["server_id"] = {"$gt": last_server_id}
+    
+    # An aggregation $project rather than a find projection: expressions in
+    # find projections ($size for member_count) need MongoDB 4.4+
+    servers = await db.servers.aggregate([
+        {"$match": query},
+        {"$sort": {"server_id": ASCENDING}},
+        {"$limit": limit + 1},
+        {"$project": SERVER_SUMMARY_PROJECTION}
+    ]).to_list(None)
+    has_more = len(servers) > limit
+    servers = servers[:limit]
+    return etag_response(request, {
+        "servers": servers,
+        "next_cursor": encode_list_cursor([servers[-1]["server_id"]]) if has_more else None
+    })
 
 @app.get("/api/servers/{server_id}/channels")
-async def get_server_channels(server_id: str, current_user: dict = Depends(get_current_user)):
+async def get_server_channels(server_id: str, request: Request, limit: Optional[int] = None,
+                              cursor: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     # Check if user is member of server
-    server = await db.servers.find_one({"server_id": server_id, "members": current_user["user_id"]})
-    if not server:
+    if not await topology.is_member(server_id, current_user["user_id"]):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    channels = await db.channels.find({"server_id": server_id}).to_list(None)
-    return {"channels": parse_json(channels)}
+    limit = list_page_size(limit)
+    query: Dict[str, Any] = {"server_id": server_id}
+    if cursor:
+        position, channel_id = decode_list_cursor(cursor, 2)
+        # Both values land in equality filters, where a dict would be read as an operator
+        if (position is not None and (not isinstance(position, int) or isinstance(position, bool))) \
+                or not isinstance(channel_id, str):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query["$or"] = [
+            {"position": {"$gt": position}},
+            {"position": position, "channel_id": {"$gt": channel_id}}
+        ]
+    
+    channels = await db.channels.find(query, CHANNEL_SUMMARY_PROJECTION) \
+        .sort([("position", ASCENDING), ("channel_id", ASCENDING)]).limit(limit + 1).to_list(None)
+    has_more = len(channels) > limit
+    channels = channels[:limit]
+    return etag_response(request, {
+        "channels": channels,
+        "next_cursor": encode_list_cursor([channels[-1].get("position"), channels[-1]["channel_id"]])
+        if has_more else None
+    })
+
+@app.get("/api/servers/{server_id}/members")
+async def get_server_members(server_id: str, request: Request, limit: Optional[int] = None,
+                             cursor: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    if not await topology.is_member(server_id, current_user["user_id"]):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    # members is kept in join order; $slice reads one window of it
+    limit = list_page_size(limit)
+    offset = decode_list_cursor(cursor, 1)[0] if cursor else 0
+    # bool is an int subclass, so a forged [true] cursor would read as offset 1
+    if type(offset) is not int or offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    server = await db.servers.find_one(
+        {"server_id": server_id},
+        {"_id": 0, "members": {"$slice": [offset, limit + 1]}}
+    )
+    member_ids = (server or {}).get("members", [])
+    has_more = len(member_ids) > limit
+    member_ids = member_ids[:limit]
+    
+    users = {
+        user["user_id"]: user
+        for user in await db.users.find({"user_id": {"$in": member_ids}}, MEMBER_PROJECTION).to_list(None)
+    }
+    members = []
+    for user_id in member_ids:
+        member = dict(users.get(user_id) or {"user_id": user_id})
+        member["presence"] = manager.user_presence.get(user_id, {"status": "offline"})
+        members.append(member)
+    return etag_response(request, {
+        "members": members,
+        "next_cursor": encode_list_cursor([offset + limit]) if has_more else None
+    })
+
+# Other workers cache server members for up to TOPOLOGY_CACHE_TTL, so
+# membership changes invalidate both caches everywhere over the bus
+async def membership_changed(server_id: str, user_id: str):
+    await manager.bus.publish("topology_server", server_id, "")
+    invalidate_user(user_id)
+    await authorizer.invalidate_user(user_id)
+
+@app.post("/api/servers/{server_id}/members")
+async def add_server_member(server_id: str, member: MemberAdd, current_user: dict = Depends(get_current_user)):
+    # Only the owner adds members; there are no invites yet
+    server = await db.servers.find_one({"server_id": server_id}, {"owner_id": 1})
+    if not server:
+        raise HTTPException(status_code=404, detail="Server not found")
+    if server["owner_id"] != current_user["user_id"]:
+        raise HTTPException(status_code=403, detail="Only the server owner can add members")
+    if not await db.users.find_one({"user_id": member.user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    result = await db.servers.update_one({"server_id": server_id}, {"$addToSet": {"members": member.user_id}})
+    if result.modified_count:
+        await db.users.update_one({"user_id": member.user_id}, {"$addToSet": {"servers": server_id}})
+        await membership_changed(server_id, member.user_id)
+    return {"success": True, "server_id": server_id, "user_id": member.user_id}
+
+@app.post("/api/servers/{server_id}/leave")
+async def leave_server(server_id: str, current_user: dict = Depends(get_current_user)):
+    user_id = current_user["user_id"]
+    result = await db.servers.update_one(
+        {"server_id": server_id, "members": user_id, "owner_id": {"$ne": user_id}},
+        {"$pull": {"members": user_id}}
+    )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=400, detail="Not a member, or the server owner")
+    await db.users.update_one({"user_id": user_id}, {"$pull": {"servers": server_id}})
+    await membership_changed(server_id, user_id)
+    return {"success": True, "server_id": server_id}
 
 @app.post("/api/channels")
 async def create_channel(channel_data: ChannelCreate, current_user: dict = Depends(get_current_user)):
@@ -305,38 +2747,53 @@ async def create_channel(channel_data: ChannelCreate, current_user: dict = Depen
     }
     
     await db.channels.insert_one(channel)
+    topology.set_channel(channel_id, channel_data.server_id)
     
     # Add channel to server
     await db.servers.update_one(
         {"server_id": channel_data.server_id},
         {"$push": {"channels": channel_id}}
     )
+    await authorizer.invalidate_server(channel_data.server_id)
     
-    return channel
+    return strip_mongo_id(channel)
 
 @app.get("/api/channels/{channel_id}/messages")
-async def get_channel_messages(channel_id: str, limit: int = 50, current_user: dict = Depends(get_current_user)):
+async def get_channel_messages(channel_id: str, limit: int = 50, before: Optional[str] = None,
+                               after: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     # Check if user has access to channel
-    channel = await db.channels.find_one({"channel_id": channel_id})
-    if not channel:
+    server_id = await topology.get_channel_server(channel_id)
+    if not server_id:
         raise HTTPException(status_code=404, detail="Channel not found")
     
-    server = await db.servers.find_one({"server_id": channel["server_id"], "members": current_user["user_id"]})
-    if not server:
+    if not await topology.is_member(server_id, current_user["user_id"]):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    messages = await db.messages.find({"channel_id": channel_id}).sort("created_at", -1).limit(limit).to_list(None)
-    messages.reverse()  # Show oldest first
+    if before or after:
+        return await fetch_message_page(channel_id, limit, before, after)
+    return await recent_messages.first_page(channel_id, limit)
+
+@app.get("/api/servers/{server_id}/search")
+async def search_server_messages(server_id: str, q: str, author_id: Optional[str] = None,
+                                 channel_id: Optional[str] = None, since: Optional[str] = None,
+                                 until: Optional[str] = None, limit: int = 25, cursor: Optional[str] = None,
+                                 current_user: dict = Depends(get_current_user)):
+    if not await topology.is_member(server_id, current_user["user_id"]):
+        raise HTTPException(status_code=403, detail="Access denied")
     
-    return {"messages": parse_json(messages)}
+    return await search_messages(server_id, q, limit, cursor, author_id=author_id,
+                                 channel_id=channel_id, since=since, until=until)
 
 @app.post("/api/messages")
 async def create_message(message_data: MessageCreate, current_user: dict = Depends(get_current_user)):
+    await rate_limiter.limit_http("messages", current_user["user_id"])
     message_id = str(uuid.uuid4())
     
     message = {
         "message_id": message_id,
         "channel_id": message_data.channel_id,
+        # Stored so search can use the server-scoped text index
+        "server_id": await topology.get_channel_server(message_data.channel_id),
         "author_id": current_user["user_id"],
         "author_username": current_user["username"],
         "author_display_name": current_user["display_name"],
@@ -345,160 +2802,640 @@ async def create_message(message_data: MessageCreate, current_user: dict = Depen
         "attachments": message_data.attachments or [],
         "created_at": datetime.utcnow().isoformat(),
         "edited_at": None,
-        "reactions": [],
+        "reaction_counts": {},
+        "reaction_samples": {},
         "replies": [],
         "pinned": False,
         "thread_id": None
     }
     
-    await db.messages.insert_one(message)
+    if MESSAGE_WRITE_BEHIND:
+        persisted = message_writer.submit(dict(message))
+    else:
+        await db.messages.insert_one(message)
+        persisted = None
+    message = strip_mongo_id(message)
+    await recent_messages.publish_append(message)
     
     # Broadcast message to channel
     await manager.broadcast_to_channel(
-        json.dumps({
-            "type": "new_message",
-            "data": parse_json(message)
-        }),
+        encode_event("new_message", message),
         message_data.channel_id
     )
     
+    if persisted is not None:
+        try:
+            await persisted
+        except PyMongoError:
+            raise HTTPException(status_code=503, detail="Message could not be saved")
+    
     return message
 
 @app.post("/api/messages/{message_id}/reactions")
 async def add_reaction(message_id: str, reaction_data: MessageReaction, current_user: dict = Depends(get_current_user)):
-    message = await db.messages.find_one({"message_id": message_id})
-    if not message:
-        raise HTTPException(status_code=404, detail="Message not found")
+    await rate_limiter.limit_http("reactions", current_user["user_id"])
+    emoji = reaction_data.emoji
+    validate_emoji(emoji)
+    marker = {"message_id": message_id, "emoji": emoji, "user_id": current_user["user_id"]}
     
     if reaction_data.action == "add":
-        # Add reaction
-        reaction = {
-            "emoji": reaction_data.emoji,
-            "user_id": current_user["user_id"],
-            "username": current_user["username"]
-        }
-        await db.messages.update_one(
-            {"message_id": message_id},
-            {"$push": {"reactions": reaction}}
-        )
+        try:
+            await db.message_reactions.insert_one(dict(marker))
+        except DuplicateKeyError:
+            # Already reacted with this emoji
+            return {"success": True, "changed": False}
+        message = await update_reaction_counter(message_id, emoji, current_user, 1)
+        if not message:
+            await db.message_reactions.delete_one(marker)
+            raise HTTPException(status_code=404, detail="Message not found")
     elif reaction_data.action == "remove":
-        # Remove reaction
-        await db.messages.update_one(
-            {"message_id": message_id},
-            {"$pull": {"reactions": {"emoji": reaction_data.emoji, "user_id": current_user["user_id"]}}}
-        )
+        result = await db.message_reactions.delete_one(marker)
+        if not result.deleted_count:
+            return {"success": True, "changed": False}
+        message = await update_reaction_counter(message_id, emoji, current_user, -1)
+        if not message:
+            raise HTTPException(status_code=404, detail="Message not found")
+    else:
+        raise HTTPException(status_code=400, detail="Unknown reaction action")
     
-    # Broadcast reaction update
-    updated_message = await db.messages.find_one({"message_id": message_id})
+    count = message.get("reaction_counts", {}).get(emoji, 0)
+    sample = message.get("reaction_samples", {}).get(emoji, [])
+    await recent_messages.publish_reaction(message["channel_id"], message_id, emoji, count, sample)
+    
+    # Broadcast only the changed counter
     await manager.broadcast_to_channel(
-        json.dumps({
-            "type": "reaction_update",
-            "data": {
-                "message_id": message_id,
-                "reactions": parse_json(updated_message["reactions"])
-            }
+        encode_event("reaction_update", {
+            "message_id": message_id,
+            "emoji": emoji,
+            "count": count,
+            "action": reaction_data.action,
+            "user_id": current_user["user_id"],
+            "username": current_user["username"]
         }),
         message["channel_id"]
     )
     
-    return {"success": True}
+    return {"success": True, "changed": True, "count": count}
+
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def start_topology_listener():
+    if TOPOLOGY_CHANGE_STREAM:
+        topology.start()
+
+@app.on_event("shutdown")
+async def stop_topology_listener():
+    topology.stop()
+
+@app.on_event("startup")
+async def start_broadcast_bus():
+    manager.bus = BROADCAST_BACKENDS[BROADCAST_BACKEND](manager)
+    await manager.bus.start()
+
+@app.on_event("shutdown")
+async def stop_broadcast_bus():
+    await manager.bus.stop()
+
+@app.on_event("startup")
+async def start_replay_spill():
+    manager.replay.start()
+
+@app.on_event("shutdown")
+async def flush_replay_spill():
+    if manager.replay.task:
+        manager.replay.task.cancel()
+    await manager.replay.flush()
+
+@app.on_event("startup")
+async def start_reaper():
+    reaper.start()
+
+@app.on_event("shutdown")
+async def stop_reaper():
+    reaper.stop()
+
+@app.on_event("startup")
+async def start_presence_batcher():
+    presence_batcher.start()
+
+@app.on_event("shutdown")
+async def stop_presence_batcher():
+    presence_batcher.stop()
+
+@app.on_event("startup")
+async def start_typing_aggregator():
+    typing_aggregator.start()
+
+@app.on_event("shutdown")
+async def stop_typing_aggregator():
+    typing_aggregator.stop()
+
+@app.on_event("shutdown")
+async def stop_password_hasher():
+    password_hasher.shutdown()
+
+@app.on_event("startup")
+async def start_token_service():
+    token_service.start()
+
+@app.on_event("shutdown")
+async def stop_token_service():
+    token_service.stop()
+
+@app.on_event("shutdown")
+async def close_rate_limiter():
+    await rate_limiter.close()
+
+@app.on_event("startup")
+async def start_message_writer():
+    if MESSAGE_WRITE_BEHIND:
+        message_writer.start()
+
+@app.on_event("shutdown")
+async def flush_message_writer():
+    await message_writer.close()
+
+HEARTBEAT_ACK = encode_event("heartbeat_ack", {})
+
+# Inbound frame types limited per user on top of the per-connection limit
+WS_USER_LIMITED_FRAMES = ("typing", "presence_update", "join_server")
+
+# Returns False when the frame should be dropped. Delaying simply stops
+# reading from this socket, which pushes back on the client through TCP.
+async def admit_frame(connection: ClientConnection, message_type: str) -> bool:
+    wait = rate_limiter.take("ws_frame", connection.rate_key)
+    route = "ws_frame"
+    # A frame the connection bucket only delays is still handled, so it is
+    # charged to its per-type bucket too and waits for whichever is slower
+    if message_type in WS_USER_LIMITED_FRAMES and (not wait or rate_limiter.delays(wait)):
+        type_wait = rate_limiter.take(message_type, connection.user_id)
+        if type_wait > wait:
+            route, wait = message_type, type_wait
+    stats = rate_limiter.stats
+    if not wait:
+        stats["allowed"] += 1
+        return True
+    if rate_limiter.delays(wait):
+        stats["delayed"] += 1
+        await asyncio.sleep(wait)
+        return True
+    if rate_limiter.policy == "disconnect":
+        stats["disconnected"] += 1
+        try:
+            await connection.websocket.close(code=1008)
+        except Exception:
+            pass
+        raise WebSocketDisconnect(1008)
+    stats["rejected"] += 1
+    connection.enqueue(
+        encode_event("rate_limited", {"route": route, "retry_after": round(wait, 3)}),
+        coalesce_key="rate_limited"
+    )
+    return False
+
+# Shared by the receive loop and the reaper; safe to call more than once
+async def end_session(connection: ClientConnection):
+    if connection.ended:
+        return
+    connection.ended = True
+    user_id = connection.user_id
+    if not manager.disconnect(connection):
+        return
+    typing_aggregator.clear_user(user_id)
+    
+    # Broadcast user left once the last session is gone
+    for server_id in manager.leave_all_servers(user_id):
+        await manager.broadcast_to_server(
+            encode_event("user_left", {
+                "user_id": user_id,
+                "server_id": server_id
+            }),
+            server_id
+        )
+
+# Evicts sessions that have sent nothing, not even a heartbeat, for
+# WS_IDLE_TIMEOUT seconds. Half-open TCP connections never raise
+# WebSocketDisconnect, so without this they would stay in active_connections
+# and keep costing a send on every broadcast.
+class ConnectionReaper:
+    def __init__(self, interval: float = WS_HEARTBEAT_INTERVAL, idle_timeout: float = WS_IDLE_TIMEOUT):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.task: Optional[asyncio.Task] = None
+        self.gauges: Dict[str, int] = {"live": 0, "zombie": 0, "evicted": 0}
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def reap(self):
+        now = time.monotonic()
+        live = zombie = 0
+        expired = []
+        for sessions in manager.active_connections.values():
+            for connection in sessions.values():
+                idle = now - connection.last_seen
+                if idle > self.idle_timeout:
+                    expired.append(connection)
+                elif idle > self.interval * 1.5:
+                    # Missed at least one heartbeat
+                    zombie += 1
+                else:
+                    live += 1
+        self.gauges["live"] = live
+        self.gauges["zombie"] = zombie
+        for connection in expired:
+            self.gauges["evicted"] += 1
+            await end_session(connection)
+            try:
+                await asyncio.wait_for(connection.websocket.close(code=4000), 5)
+            except Exception:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.reap()
+
+reaper = ConnectionReaper()
+
+async def resume_session(connection: ClientConnection, message_data: dict, auth: AuthorizationContext):
+    if message_data.get("epoch") != manager.replay.epoch:
+        connection.enqueue(encode_event("resync_required", {"epoch": manager.replay.epoch}))
+        return
+    requested = message_data.get("positions") or {}
+    if not isinstance(requested, dict):
+        connection.enqueue(encode_event("resync_required", {"epoch": manager.replay.epoch}))
+        return
+    positions = {}
+    for server_id, last_seq in requested.items():
+        if not auth.can_join(server_id):
+            authorizer.deny(connection, "resume", server_id)
+            continue
+        manager.join_server(server_id, connection.user_id)
+        if not isinstance(last_seq, int) or isinstance(last_seq, bool) or last_seq < 0:
+            connection.enqueue(encode_event("resync_required", {"server_id": server_id}))
+            continue
+        frames = await manager.replay.since(server_id, last_seq)
+        if frames is None:
+            connection.enqueue(encode_event("resync_required", {"server_id": server_id}))
+            continue
+        for frame in frames:
+            connection.enqueue(frame)
+        positions[server_id] = manager.replay.latest(server_id)
+    connection.enqueue(encode_event("resumed", {"positions": positions}))
 
 # WebSocket endpoint
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
+async def websocket_endpoint(websocket: WebSocket, user_id: str, session: Optional[str] = None):
+    # Clients pass a per-tab session id so a reconnect replaces only its own socket
+    if session and len(session) > 64:
+        session = None
+    claims = await authorizer.authenticate(websocket, user_id)
+    if claims is None:
+        return
+    auth = await authorizer.load(claims)
+    connection = await manager.connect(websocket, user_id, session, auth)
+    connection.enqueue(encode_event("hello", {
+        "session_id": connection.session_id,
+        "epoch": manager.replay.epoch,
+        "heartbeat_interval": WS_HEARTBEAT_INTERVAL,
+        # Typists re-send "typing" well inside this or drop off the indicator
+        "typing_ttl": typing_aggregator.ttl,
+        "encoding": connection.codec.name if connection.codec else "json"
+    }))
     
     try:
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message_data = await connection.receive()
+            connection.last_seen = time.monotonic()
+            if not await admit_frame(connection, message_data["type"]):
+                continue
             
-            if message_data["type"] == "typing":
-                # Broadcast typing indicator
-                await manager.broadcast_to_channel(
-                    json.dumps({
-                        "type": "typing",
-                        "data": {
-                            "user_id": user_id,
-                            "channel_id": message_data["channel_id"],
-                            "username": message_data.get("username", "Unknown")
-                        }
-                    }),
-                    message_data["channel_id"]
-                )
-            elif message_data["type"] == "stop_typing":
-                # Broadcast stop typing
-                await manager.broadcast_to_channel(
-                    json.dumps({
-                        "type": "stop_typing",
-                        "data": {
-                            "user_id": user_id,
-                            "channel_id": message_data["channel_id"]
-                        }
-                    }),
-                    message_data["channel_id"]
-                )
+            # Heartbeats go through here too, so a stale context is reloaded
+            # within one heartbeat interval even on an otherwise quiet socket
+            auth = await authorizer.current(connection)
+            if auth is None:
+                await websocket.close(code=WS_CLOSE_UNAUTHORIZED)
+                break
+            
+            if message_data["type"] == "heartbeat":
+                connection.enqueue(HEARTBEAT_ACK, coalesce_key="heartbeat")
+            elif message_data["type"] in ("typing", "stop_typing"):
+                channel_id = message_data.get("channel_id")
+                if auth.channel_server(channel_id) is None:
+                    authorizer.deny(connection, message_data["type"], channel_id)
+                elif message_data["type"] == "typing":
+                    # Coalesced into one typing_users update per channel per interval;
+                    # the name comes from the token, never from the frame
+                    typing_aggregator.start_typing(channel_id, user_id, auth.claims["username"])
+                else:
+                    typing_aggregator.stop_typing(channel_id, user_id)
             elif message_data["type"] == "join_server":
+                server_id = message_data.get("server_id")
+                if not auth.can_join(server_id):
+                    authorizer.deny(connection, "join_server", server_id)
+                    continue
                 # Add user to server members for broadcasting
-                server_id = message_data["server_id"]
-                if server_id not in manager.server_members:
-                    manager.server_members[server_id] = []
-                if user_id not in manager.server_members[server_id]:
-                    manager.server_members[server_id].append(user_id)
+                manager.join_server(server_id, user_id)
                     
                 # Broadcast user joined
                 await manager.broadcast_to_server(
-                    json.dumps({
-                        "type": "user_joined",
-                        "data": {
-                            "user_id": user_id,
-                            "server_id": server_id,
-                            "presence": manager.user_presence.get(user_id, {})
-                        }
+                    encode_event("user_joined", {
+                        "user_id": user_id,
+                        "server_id": server_id,
+                        "presence": manager.user_presence.get(user_id, {})
                     }),
                     server_id
                 )
+            elif message_data["type"] == "resume":
+                # Replay missed server events instead of a full REST reload
+                await resume_session(connection, message_data, auth)
             elif message_data["type"] == "presence_update":
                 # Update user presence
                 if user_id in manager.user_presence:
                     manager.user_presence[user_id].update(message_data["data"])
                     
-                # Broadcast presence update
-                for server_id, members in manager.server_members.items():
-                    if user_id in members:
-                        await manager.broadcast_to_server(
-                            json.dumps({
-                                "type": "presence_update",
-                                "data": {
-                                    "user_id": user_id,
-                                    "presence": manager.user_presence[user_id]
-                                }
-                            }),
-                            server_id
-                        )
+                # Debounced and delivered as one batch per server
+                presence_batcher.update(user_id, dict(manager.user_presence[user_id]))
             
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
-        
-        # Broadcast user left
-        for server_id, members in manager.server_members.items():
-            if user_id in members:
-                members.remove(user_id)
-                await manager.broadcast_to_server(
-                    json.dumps({
-                        "type": "user_left",
-                        "data": {
-                            "user_id": user_id,
-                            "server_id": server_id
-                        }
-                    }),
-                    server_id
-                )
+        pass
+    finally:
+        await end_session(connection)
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy", "service": "Xalvion Backend"}
+    return {
+        "status": "healthy",
+        "service": "Xalvion Backend",
+        "caches": {
+            "users": user_cache.snapshot(),
+            "channel_servers": topology.channel_servers.snapshot(),
+            "server_members": topology.server_members.snapshot(),
+            "recent_messages": recent_messages.snapshot()
+        },
+        "connections": {
+            "users": len(manager.active_connections),
+            "sessions": manager.session_count(),
+            **reaper.gauges
+        },
+        "typing": typing_aggregator.stats,
+        "presence": presence_batcher.stats,
+        "rate_limits": rate_limiter.stats,
+        "authorization": authorizer.stats,
+        "topology": topology.stats,
+        "bus": manager.bus.stats,
+        "replay": manager.replay.snapshot()
+    }
+
+# Loop profiler configuration
+LOOP_PROFILER = os.environ.get('LOOP_PROFILER', 'false').lower() == 'true'
+LOOP_SLOW_CALLBACK_MS = float(os.environ.get('LOOP_SLOW_CALLBACK_MS', '100'))
+LOOP_LAG_INTERVAL_MS = float(os.environ.get('LOOP_LAG_INTERVAL_MS', '500'))
+LOOP_PROFILER_HISTORY = int(os.environ.get('LOOP_PROFILER_HISTORY', '50'))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+LOOP_LAG = metrics.histogram("xalvion_event_loop_lag_seconds", "Extra delay of a sleeping sampler task")
+SLOW_CALLBACKS = metrics.counter("xalvion_slow_callbacks_total", "Loop callbacks slower than the threshold",
+                                 ("handler",))
+ROUTE_CPU = metrics.counter("xalvion_handler_cpu_seconds_total", "Event-loop CPU time per handler",
+                            ("handler",))
+
+def _describe_callback(handle: asyncio.Handle) -> str:
+    # Task steps are the interesting case: name the coroutine, not the wrapper
+    owner = getattr(handle._callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return f"{owner.get_name()} {getattr(coro, '__qualname__', coro)}"
+    return repr(handle)[:200]
+
+# Opt-in, switchable at runtime. While enabled it wraps asyncio's Handle._run
+# to time every callback and task step on the loop, attributing CPU time to
+# the handler whose context the step runs in. A watchdog thread grabs the
+# loop thread's stack while a callback is still running past the threshold,
+# which points at the blocking line rather than at whatever ran afterwards.
+# Only the pure-Python loop is covered (not uvloop).
+class LoopProfiler:
+    def __init__(self, threshold: float = LOOP_SLOW_CALLBACK_MS / 1000,
+                 lag_interval: float = LOOP_LAG_INTERVAL_MS / 1000, history: int = LOOP_PROFILER_HISTORY):
+        self.threshold = threshold
+        self.lag_interval = lag_interval
+        self.enabled = False
+        self.slow_callbacks: deque = deque(maxlen=history)
+        self.lag = {"last_ms": 0.0, "max_ms": 0.0}
+        # [handle, started, stack captured by the watchdog]
+        self.current: Optional[list] = None
+        self.loop_thread_id: Optional[int] = None
+        self.lag_task: Optional[asyncio.Task] = None
+        self.watchdog: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+        self._original_run = None
+
+    def enable(self, threshold: Optional[float] = None):
+        if threshold:
+            self.threshold = threshold
+        if self.enabled:
+            return
+        self.enabled = True
+        self.loop_thread_id = threading.get_ident()
+        self.lag = {"last_ms": 0.0, "max_ms": 0.0}
+        self._original_run = original = asyncio.Handle._run
+        profiler = self
+
+        def _run(handle):
+            state = profiler.current = [handle, time.perf_counter(), None]
+            cpu = time.thread_time()
+            try:
+                original(handle)
+            finally:
+                profiler.current = None
+                elapsed = time.perf_counter() - state[1]
+                context = handle._context.get(request_context) if handle._context is not None else None
+                handler = handler_name(context)
+                ROUTE_CPU.inc(handler, amount=time.thread_time() - cpu)
+                if elapsed >= profiler.threshold:
+                    profiler._record(handle, handler, elapsed, state[2])
+
+        asyncio.Handle._run = _run
+        self.stopped.clear()
+        self.watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.watchdog.start()
+        # enable() may run inside an admin request; a task copies the current
+        # context, so start the sampler from an empty one or its CPU time
+        # would be charged to that route
+        self.lag_task = Context().run(asyncio.create_task, self._sample_lag())
+        logger.info("Loop profiler enabled (threshold %.0f ms)", self.threshold * 1000)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        asyncio.Handle._run = self._original_run
+        self.stopped.set()
+        if self.lag_task:
+            self.lag_task.cancel()
+            self.lag_task = None
+        logger.info("Loop profiler disabled")
+
+    def _watch(self):
+        while not self.stopped.wait(max(0.01, self.threshold / 2)):
+            state = self.current
+            if state is None or state[2] is not None or time.perf_counter() - state[1] < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is not None:
+                state[2] = "".join(traceback.format_stack(frame))
+
+    def _record(self, handle: asyncio.Handle, handler: str, elapsed: float, stack: Optional[str]):
+        SLOW_CALLBACKS.inc(handler)
+        callback = _describe_callback(handle)
+        self.slow_callbacks.append({
+            "at": datetime.utcnow().isoformat(),
+            "handler": handler,
+            "callback": callback,
+            "duration_ms": round(elapsed * 1000, 2),
+            "stack": stack
+        })
+        logger.warning("Slow callback: %s in %s took %.0f ms%s", callback, handler, elapsed * 1000,
+                       f"\n{stack}" if stack else "")
+
+    async def _sample_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, loop.time() - before - self.lag_interval)
+            LOOP_LAG.observe(lag)
+            self.lag["last_ms"] = round(lag * 1000, 2)
+            self.lag["max_ms"] = max(self.lag["max_ms"], self.lag["last_ms"])
+
+    def report(self) -> dict:
+        cpu = sorted(((labels[0], value) for labels, value in ROUTE_CPU.values.items()),
+                     key=lambda item: item[1], reverse=True)
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold * 1000,
+            "lag": self.lag,
+            "handler_cpu_seconds": {handler: round(value, 4) for handler, value in cpu},
+            "slow_callbacks": list(self.slow_callbacks)
+        }
+
+loop_profiler = LoopProfiler()
+
+@app.on_event("startup")
+async def start_loop_profiler():
+    if LOOP_PROFILER:
+        loop_profiler.enable()
+
+@app.on_event("shutdown")
+async def stop_loop_profiler():
+    loop_profiler.disable()
+
+def _labelled(stats: Dict[str, Any]) -> list:
+    return [((key,), value) for key, value in stats.items()]
+
+def _queue_depths() -> List[int]:
+    return [len(connection.queue) for sessions in manager.active_connections.values()
+            for connection in sessions.values()]
+
+def _cache_snapshots() -> Dict[str, Dict[str, int]]:
+    return {
+        "users": user_cache.snapshot(),
+        "channel_servers": topology.channel_servers.snapshot(),
+        "server_members": topology.server_members.snapshot(),
+        "recent_messages": recent_messages.snapshot()
+    }
+
+metrics.collector("xalvion_ws_active_users", "Users with at least one socket",
+                  lambda: len(manager.active_connections))
+metrics.collector("xalvion_ws_active_sockets", "Open WebSocket sessions", manager.session_count)
+metrics.collector("xalvion_ws_sessions", "Sessions by heartbeat state at the last reaper pass",
+                  lambda: [(("live",), reaper.gauges["live"]), (("zombie",), reaper.gauges["zombie"])], ("state",))
+metrics.collector("xalvion_ws_evicted_total", "Sessions evicted by the idle reaper",
+                  lambda: reaper.gauges["evicted"], kind="counter")
+metrics.collector("xalvion_ws_queue_depth", "Frames queued across all sockets", lambda: sum(_queue_depths()))
+metrics.collector("xalvion_ws_queue_depth_max", "Deepest socket send queue", lambda: max(_queue_depths(), default=0))
+metrics.collector("xalvion_ws_frames_total", "Outbound frame outcomes", lambda: _labelled(manager.stats),
+                  ("outcome",), kind="counter")
+metrics.collector("xalvion_cache_entries", "Entries per cache",
+                  lambda: [((name,), snap["size"]) for name, snap in _cache_snapshots().items()], ("cache",))
+metrics.collector("xalvion_cache_requests_total", "Cache lookups by result",
+                  lambda: [((name, result), snap[result]) for name, snap in _cache_snapshots().items()
+                           for result in ("hits", "misses")], ("cache", "result"), kind="counter")
+metrics.collector("xalvion_typing_events_total", "Typing aggregator events", lambda: _labelled(typing_aggregator.stats),
+                  ("event",), kind="counter")
+metrics.collector("xalvion_presence_events_total", "Presence batcher events", lambda: _labelled(presence_batcher.stats),
+                  ("event",), kind="counter")
+metrics.collector("xalvion_rate_limit_decisions_total", "Rate limiter decisions", lambda: _labelled(rate_limiter.stats),
+                  ("decision",), kind="counter")
+metrics.collector("xalvion_message_writes_total", "Write-behind batch results", lambda: _labelled(message_writer.stats),
+                  ("result",), kind="counter")
+metrics.collector("xalvion_message_write_pending", "Messages waiting for a write-behind batch",
+                  lambda: len(message_writer.pending))
+metrics.collector("xalvion_auth_tokens_total", "Token service events", lambda: _labelled(token_service.stats),
+                  ("event",), kind="counter")
+metrics.collector("xalvion_broadcast_bus_events_total", "Broadcast bus listener events",
+                  lambda: _labelled(manager.bus.stats), ("event",), kind="counter")
+metrics.collector("xalvion_replay_retained_frames", "Frames held by the replay log", lambda: manager.replay.frames)
+metrics.collector("xalvion_replay_retained_bytes", "Bytes of frames held by the replay log",
+                  lambda: manager.replay.bytes)
+metrics.collector("xalvion_replay_evicted_total", "Frames dropped from the replay log",
+                  lambda: manager.replay.evicted, kind="counter")
+metrics.collector("xalvion_ws_authorization_total", "Socket handshake and authorization context events",
+                  lambda: _labelled(authorizer.stats), ("event",), kind="counter")
+metrics.collector("xalvion_auth_claims_cached", "Verified access tokens in the claims cache",
+                  lambda: len(token_service.claims))
+metrics.collector("xalvion_bcrypt_pending", "bcrypt jobs queued or running", lambda: password_hasher.pending)
+metrics.collector("xalvion_bcrypt_rejected_total", "Auth requests rejected by bcrypt backpressure",
+                  lambda: password_hasher.rejected, kind="counter")
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Admin endpoints are off unless ADMIN_TOKEN is set
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+@app.get("/api/admin/profiler", dependencies=[Depends(require_admin)])
+async def get_profiler():
+    return loop_profiler.report()
+
+@app.post("/api/admin/profiler", dependencies=[Depends(require_admin)])
+async def set_profiler(settings: ProfilerSettings):
+    if settings.enabled:
+        loop_profiler.enable(settings.threshold_ms / 1000 if settings.threshold_ms else None)
+    else:
+        loop_profiler.disable()
+    return loop_profiler.report()
 
 if __name__ == "__main__":
+    if "--check-indexes" in sys.argv:
+        logging.basicConfig(level=logging.INFO)
+        sys.exit(asyncio.run(check_indexes()))
+    if "--backfill-search" in sys.argv:
+        logging.basicConfig(level=logging.INFO)
+        print(f"✅ Stamped server_id on {asyncio.run(backfill_message_servers())} messages")
+        sys.exit(0)
+    if "--backfill-reactions" in sys.argv:
+        logging.basicConfig(level=logging.INFO)
+        print(f"✅ Migrated legacy reactions on {asyncio.run(backfill_reactions())} messages")
+        sys.exit(0)
+
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # Browsers always offer permessage-deflate; context takeover is what lets
+    # small, repetitive event frames compress well
+    uvicorn.run(app, host="0.0.0.0", port=8001, ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE)
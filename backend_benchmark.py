@@ -0,0 +1,686 @@
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import server
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+BENCH_MONGO_URL = os.environ.get("BENCH_MONGO_URL", "mongodb://localhost:27017")
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class FakeWebSocket:
+    """Stand-in socket that records when each frame was delivered"""
+
+    def __init__(self, delay=0.0, tracker=None, subprotocols=None):
+        self.delay = delay
+        self.tracker = tracker
+        self.delivered = []
+        self.scope = {"subprotocols": subprotocols or []}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.delivered.append(time.perf_counter())
+        if self.tracker:
+            self.tracker.mark()
+
+    async def send_bytes(self, data):
+        await self.send_text(data)
+
+    async def close(self, code=1000):
+        pass
+
+
+class DeliveryTracker:
+    """Fires an event once the expected number of frames has been delivered"""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.count = 0
+        self.done = asyncio.Event()
+
+    def mark(self):
+        self.count += 1
+        if self.count >= self.expected:
+            self.done.set()
+
+
+class XalvionBenchmark:
+    def __init__(self):
+        self.results = {}
+        self.failures = []
+
+    def fail(self, name, reason):
+        """Record a failed check; main() exits nonzero if there are any"""
+        self.failures.append(f"{name}: {reason}")
+        print(f"❌ {name}: {reason}")
+
+    def report(self, name, rows):
+        self.results[name] = rows
+        print(f"\n📊 {name}")
+        for row in rows:
+            print("   " + "  ".join(f"{k}={v}" for k, v in row.items()))
+
+    async def _fanout_once(self, members, slow_every, slow_delay, sequential):
+        manager = server.ConnectionManager()
+        sockets = {}
+        connections = []
+        tracker = DeliveryTracker(members)
+        for i in range(members):
+            user_id = f"user-{i}"
+            ws = FakeWebSocket(slow_delay if slow_every and i % slow_every == 0 else 0.0, tracker)
+            sockets[user_id] = ws
+            connections.append(await manager.connect(ws, user_id))
+        for user_id in sockets:
+            manager.join_server("bench", user_id)
+        frame = json.dumps({"type": "new_message", "data": {"content": "x" * 200}})
+
+        start = time.perf_counter()
+        if sequential:
+            # Reference: the old one-socket-at-a-time loop
+            for user_id in manager.server_members["bench"]:
+                await sockets[user_id].send_text(frame)
+        else:
+            await manager.broadcast_to_server(frame, "bench")
+            await tracker.done.wait()
+
+        latencies = [(ws.delivered[0] - start) * 1000 for ws in sockets.values() if not ws.delay]
+        for connection in connections:
+            manager.disconnect(connection)
+        return latencies
+
+    def bench_fanout(self, sizes=(10, 100, 1000, 5000), slow_every=100, slow_delay=0.02):
+        """p99 delivery latency to healthy sockets as the member count grows"""
+        rows = []
+        for members in sizes:
+            for mode in ("sequential", "fanout"):
+                latencies = asyncio.run(self._fanout_once(members, slow_every, slow_delay, mode == "sequential"))
+                rows.append({
+                    "members": members,
+                    "mode": mode,
+                    "p50_ms": round(statistics.median(latencies), 3),
+                    "p99_ms": round(percentile(latencies, 99), 3),
+                })
+        self.report("Broadcast fan-out latency", rows)
+        return rows
+
+    def _sample_message(self):
+        return {
+            "_id": server.ObjectId(),
+            "message_id": str(uuid.uuid4()),
+            "channel_id": str(uuid.uuid4()),
+            "author_id": str(uuid.uuid4()),
+            "author_username": "benchmark",
+            "author_display_name": "Benchmark User",
+            "content": "The quick brown fox jumps over the lazy dog. " * 4,
+            "message_type": "text",
+            "attachments": [],
+            "created_at": datetime.utcnow().isoformat(),
+            "edited_at": None,
+            "reactions": [{"emoji": "🔥", "user_id": str(uuid.uuid4()), "username": "fan"}] * 5,
+            "replies": [],
+            "pinned": False,
+            "thread_id": None
+        }
+
+    def bench_serialize(self, iterations=20000):
+        """parse_json + json.dumps per event versus encode_event once"""
+        message = self._sample_message()
+
+        def legacy():
+            return json.dumps({"type": "new_message", "data": server.parse_json(message)})
+
+        def encoded_once():
+            return server.encode_event("new_message", server.strip_mongo_id(message))
+
+        rows = []
+        for name, fn in (("parse_json", legacy), ("encode_event", encoded_once)):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                frame = fn()
+            per_event_us = (time.perf_counter() - start) / iterations * 1e6
+            rows.append({
+                "path": name,
+                "per_event_us": round(per_event_us, 2),
+                "frame_bytes": len(frame.encode("utf-8")),
+            })
+        self.report("Event serialization", rows)
+        return rows
+
+    def _event_mix(self, count):
+        # Roughly what a busy channel emits: messages plus the chatter around them
+        events = []
+        for i in range(count):
+            kind = i % 4
+            if kind == 0:
+                message = server.strip_mongo_id(self._sample_message())
+                message.update({
+                    "content": " ".join(uuid.uuid4().hex[:1 + j % 8] for j in range(24)),
+                    "reactions": [], "reaction_counts": {}, "reaction_samples": {}
+                })
+                events.append(server.encode_event("new_message", message))
+            elif kind == 1:
+                events.append(server.encode_event("typing_users", {
+                    "channel_id": "c1", "node": server.NODE_ID,
+                    "users": [{"user_id": str(uuid.uuid4()), "username": "typist"}]
+                }))
+            elif kind == 2:
+                events.append(server.encode_event("presence_batch", {"server_id": "s1", "updates": [
+                    {"user_id": str(uuid.uuid4()), "presence": {"status": "online", "activity": "online"}}
+                ] * 3}))
+            else:
+                events.append(server.encode_event("reaction_update", {
+                    "message_id": str(uuid.uuid4()), "emoji": "🔥", "count": i,
+                    "action": "add", "user_id": str(uuid.uuid4()), "username": "fan"
+                }))
+        return events
+
+    def _deliver_encoded(self, events, recipients, codec, deflate):
+        # permessage-deflate keeps one compressor per socket (context takeover),
+        # so compression is paid per recipient while transcoding is paid per event
+        compressors = [zlib.compressobj(6, zlib.DEFLATED, -15) for _ in range(recipients)] if deflate else None
+        total_bytes = 0
+        start = time.process_time()
+        for frame in events:
+            for r in range(recipients):
+                payload = frame.encode("utf-8") if codec is None else codec.encode(frame)
+                if deflate:
+                    compressor = compressors[r]
+                    payload = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                    payload = payload[:-4]
+                total_bytes += len(payload)
+        cpu = time.process_time() - start
+        return total_bytes, cpu
+
+    def bench_encoding(self, events=2000, recipients=50):
+        """Bytes and CPU per delivered event for JSON and binary encodings, with and without deflate"""
+        frames = self._event_mix(events)
+        codecs = [("json", None)] + [(name, server.FrameCodec(name, codec.dumps, codec.loads))
+                                     for name, codec in server.WS_CODECS.items()]
+        rows = []
+        for name, codec in codecs:
+            for deflate in (False, True):
+                if codec is not None:
+                    codec.cache.clear()
+                total_bytes, cpu = self._deliver_encoded(frames, recipients, codec, deflate)
+                delivered = events * recipients
+                rows.append({
+                    "encoding": name,
+                    "deflate": deflate,
+                    "bytes_per_event": round(total_bytes / delivered, 1),
+                    "cpu_us_per_event": round(cpu / delivered * 1e6, 2),
+                })
+        self.report("WebSocket encoding cost per delivered event", rows)
+        return rows
+
+    async def _sample_loop_lag(self, stop, interval=0.005):
+        lags = []
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            before = loop.time()
+            await asyncio.sleep(interval)
+            lags.append((loop.time() - before - interval) * 1000)
+        return lags
+
+    async def _login_storm(self, logins, offload, rounds):
+        hashed = server.hash_password("benchmark-password", rounds)
+        hasher = server.PasswordHasher(max_pending=logins, rounds=rounds)
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(self._sample_loop_lag(stop))
+
+        async def login():
+            if offload:
+                await hasher.verify("benchmark-password", hashed)
+            else:
+                server.verify_password("benchmark-password", hashed)
+                await asyncio.sleep(0)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        lags = await sampler
+        hasher.shutdown()
+        return elapsed, lags
+
+    def bench_login_storm(self, logins=40, rounds=10):
+        """Event-loop lag while a burst of bcrypt logins is processed"""
+        rows = []
+        for mode in ("inline", "thread_pool"):
+            elapsed, lags = asyncio.run(self._login_storm(logins, mode == "thread_pool", rounds))
+            rows.append({
+                "mode": mode,
+                "logins": logins,
+                "logins_per_sec": round(logins / elapsed, 1),
+                "lag_p99_ms": round(percentile(lags, 99), 2),
+                "lag_max_ms": round(max(lags) if lags else 0.0, 2),
+            })
+        self.report("Login storm event-loop lag", rows)
+        return rows
+
+    async def _bench_db(self):
+        client = AsyncIOMotorClient(BENCH_MONGO_URL, serverSelectionTimeoutMS=2000)
+        try:
+            await client.admin.command("ping")
+        except PyMongoError as e:
+            print(f"\n⚠️  Skipping: no MongoDB at {BENCH_MONGO_URL} ({e.__class__.__name__})")
+            return None
+        server.db = client.xalvion_bench
+        return server.db
+
+    async def _seed_channel(self, db, channel_id, count, batch=10000):
+        existing = await db.messages.count_documents({"channel_id": channel_id})
+        base = datetime(2024, 1, 1)
+        for offset in range(existing, count, batch):
+            await db.messages.insert_many([
+                {
+                    "message_id": f"{i:012d}",
+                    "channel_id": channel_id,
+                    "author_id": "bench",
+                    "author_username": "bench",
+                    "author_display_name": "Bench",
+                    "content": f"seeded message {i}",
+                    "message_type": "text",
+                    "attachments": [],
+                    "created_at": (base + timedelta(milliseconds=i)).isoformat(),
+                    "edited_at": None,
+                    "reactions": [],
+                    "replies": [],
+                    "pinned": False,
+                    "thread_id": None
+                }
+                for i in range(offset, min(offset + batch, count))
+            ], ordered=False)
+
+    async def _history(self, messages, samples):
+        db = await self._bench_db()
+        if db is None:
+            return []
+        channel_id = "bench-history"
+        await self._seed_channel(db, channel_id, messages)
+        await server.ensure_indexes()
+
+        rows = []
+        base = datetime(2024, 1, 1)
+        for depth in (0, 1000, 100000, messages // 2, messages - 100):
+            i = messages - depth
+            cursor = None if depth == 0 else server.encode_cursor({
+                "created_at": (base + timedelta(milliseconds=i)).isoformat(),
+                "message_id": f"{i:012d}"
+            })
+            timings = []
+            for _ in range(samples):
+                start = time.perf_counter()
+                page = await server.fetch_message_page(channel_id, 50, before=cursor)
+                timings.append((time.perf_counter() - start) * 1000)
+            explain = await db.messages.find(
+                server.keyset_filter(channel_id, cursor, "$lt") if cursor else {"channel_id": channel_id}
+            ).sort([("created_at", -1), ("message_id", -1)]).limit(51).explain()
+            stats = explain.get("executionStats", {})
+            rows.append({
+                "depth": depth,
+                "page_size": len(page["messages"]),
+                "p50_ms": round(statistics.median(timings), 2),
+                "p99_ms": round(percentile(timings, 99), 2),
+                "docs_examined": stats.get("totalDocsExamined"),
+            })
+        return rows
+
+    def bench_history(self, messages=1000000, samples=50):
+        """Keyset page fetch latency at increasing depth in a 1M-message channel"""
+        rows = asyncio.run(self._history(messages, samples))
+        if rows:
+            self.report("Message history pagination", rows)
+        return rows
+
+    async def _seed_search_corpus(self, db, messages, servers, channels_per_server, vocabulary, batch=10000):
+        # Zipf-like word frequencies so common and rare terms both exist
+        words = [f"term{n}" for n in range(vocabulary)]
+        weights = [1.0 / (n + 1) for n in range(vocabulary)]
+        existing = await db.messages.count_documents({"message_id": {"$regex": "^search-"}})
+        rng = random.Random(existing)
+        base = datetime(2024, 1, 1)
+        for offset in range(existing, messages, batch):
+            docs = []
+            for i in range(offset, min(offset + batch, messages)):
+                server_index = i % servers
+                channel_index = (i // servers) % channels_per_server
+                docs.append({
+                    "message_id": f"search-{i:012d}",
+                    "server_id": f"bench-search-{server_index}",
+                    "channel_id": f"bench-search-{server_index}-{channel_index}",
+                    "author_id": f"author-{i % 500}",
+                    "author_username": "bench",
+                    "author_display_name": "Bench",
+                    "content": " ".join(rng.choices(words, weights, k=12)),
+                    "message_type": "text",
+                    "attachments": [],
+                    "created_at": (base + timedelta(seconds=i)).isoformat(),
+                    "edited_at": None,
+                    "reaction_counts": {},
+                    "reaction_samples": {},
+                    "replies": [],
+                    "pinned": False,
+                    "thread_id": None
+                })
+            await db.messages.insert_many(docs, ordered=False)
+
+    async def _search(self, messages, servers, channels_per_server, vocabulary, samples):
+        db = await self._bench_db()
+        if db is None:
+            return []
+        await self._seed_search_corpus(db, messages, servers, channels_per_server, vocabulary)
+        await server.ensure_indexes()
+
+        server_id = "bench-search-0"
+        middle = (datetime(2024, 1, 1) + timedelta(seconds=messages // 2)).isoformat()
+        cases = [
+            ("common_term", "term0", {}),
+            ("rare_term", f"term{vocabulary - 1}", {}),
+            ("two_terms", "term3 term7", {}),
+            ("phrase", '"term1 term2"', {}),
+            ("channel_filter", "term5", {"channel_id": f"{server_id}-0"}),
+            ("author_filter", "term5", {"author_id": "author-0"}),
+            ("date_filter", "term5", {"since": middle}),
+        ]
+        rows = []
+        for name, query, filters in cases:
+            timings = []
+            for _ in range(samples):
+                start = time.perf_counter()
+                page = await server.search_messages(server_id, query, 25, **filters)
+                timings.append((time.perf_counter() - start) * 1000)
+            explain = await db.messages.find(server.search_filter(server_id, query, **filters),
+                                             server.SEARCH_PROJECTION) \
+                .sort(server.SEARCH_SORT).limit(26).explain()
+            rows.append({
+                "case": name,
+                "results": len(page["results"]),
+                "p50_ms": round(statistics.median(timings), 2),
+                "p99_ms": round(percentile(timings, 99), 2),
+                "docs_examined": explain.get("executionStats", {}).get("totalDocsExamined"),
+            })
+
+        # Reference: what a hand-written regex search over the server's channels costs
+        channels = [f"{server_id}-{c}" for c in range(channels_per_server)]
+        start = time.perf_counter()
+        found = await db.messages.find(
+            {"channel_id": {"$in": channels}, "content": {"$regex": f"term{vocabulary - 1}\\b", "$options": "i"}},
+            {"_id": 0, "message_id": 1}
+        ).limit(25).to_list(None)
+        rows.append({
+            "case": "regex_scan_rare_term",
+            "results": len(found),
+            "p50_ms": round((time.perf_counter() - start) * 1000, 2),
+            "p99_ms": None,
+            "docs_examined": None,
+        })
+        return rows
+
+    def bench_search(self, messages=10000000, servers=100, channels_per_server=10, vocabulary=5000, samples=20):
+        """Ranked text search latency in one server of a 10M-message corpus"""
+        rows = asyncio.run(self._search(messages, servers, channels_per_server, vocabulary, samples))
+        if rows:
+            self.report("Message search", rows)
+        return rows
+
+    def _new_message(self, channel_id, i):
+        return {
+            "message_id": str(uuid.uuid4()),
+            "channel_id": channel_id,
+            "author_id": "bench",
+            "author_username": "bench",
+            "author_display_name": "Bench",
+            "content": f"burst message {i}",
+            "message_type": "text",
+            "attachments": [],
+            "created_at": datetime.utcnow().isoformat(),
+            "edited_at": None,
+            "reactions": [],
+            "replies": [],
+            "pinned": False,
+            "thread_id": None
+        }
+
+    async def _insert_throughput(self, messages, concurrency):
+        db = await self._bench_db()
+        if db is None:
+            return []
+        await db.messages.delete_many({"channel_id": "bench-burst"})
+        rows = []
+        for mode in ("insert_one", "write_behind_accepted", "write_behind_persisted"):
+            writer = None
+            if mode != "insert_one":
+                writer = server.MessageWriteBehind(ack=mode.rsplit("_", 1)[1])
+                writer.start()
+            queue = list(range(messages))
+
+            async def client():
+                while queue:
+                    message = self._new_message("bench-burst", queue.pop())
+                    if writer is None:
+                        await db.messages.insert_one(message)
+                    else:
+                        persisted = writer.submit(message)
+                        if persisted is not None:
+                            await persisted
+
+            start = time.perf_counter()
+            await asyncio.gather(*(client() for _ in range(concurrency)))
+            accepted = time.perf_counter() - start
+            if writer is not None:
+                await writer.close()
+            durable = time.perf_counter() - start
+            rows.append({
+                "mode": mode,
+                "messages": messages,
+                "accepted_per_sec": round(messages / accepted),
+                "durable_per_sec": round(messages / durable),
+                "batches": writer.stats["batches"] if writer else messages,
+            })
+        return rows
+
+    def bench_write_behind(self, messages=20000, concurrency=200):
+        """Message insert throughput with and without write-behind batching"""
+        rows = asyncio.run(self._insert_throughput(messages, concurrency))
+        if rows:
+            self.report("Message insert throughput", rows)
+        return rows
+
+    def _presence_topology(self, users, servers, servers_per_user):
+        manager = server.ConnectionManager()
+        legacy: dict = {}
+        for i in range(users):
+            user_id = f"user-{i}"
+            for k in range(servers_per_user):
+                server_id = f"server-{(i * 7 + k * 131) % servers}"
+                manager.join_server(server_id, user_id)
+                legacy.setdefault(server_id, []).append(user_id)
+        return manager, legacy
+
+    async def _presence_churn(self, users, servers, servers_per_user, updates):
+        manager, legacy = self._presence_topology(users, servers, servers_per_user)
+        changed = [f"user-{(i * 7919) % users}" for i in range(updates)]
+        presence = {"status": "online", "activity": "online"}
+
+        # Reference: the old scan over every server's member list per update
+        start = time.perf_counter()
+        legacy_sends = 0
+        for user_id in changed:
+            for server_id, members in legacy.items():
+                if user_id in members:
+                    legacy_sends += 1
+        legacy_elapsed = time.perf_counter() - start
+
+        original = server.manager
+        server.manager = manager
+        try:
+            batcher = server.PresenceBatcher()
+            start = time.perf_counter()
+            for user_id in changed:
+                batcher.update(user_id, presence)
+            await batcher.flush()
+            indexed_elapsed = time.perf_counter() - start
+        finally:
+            server.manager = original
+
+        return [
+            {"path": "scan_server_members", "users": users, "updates": updates,
+             "per_update_us": round(legacy_elapsed / updates * 1e6, 1), "server_events": legacy_sends},
+            {"path": "membership_index_batched", "users": users, "updates": updates,
+             "per_update_us": round(indexed_elapsed / updates * 1e6, 1), "server_events": batcher.stats["batches"]},
+        ]
+
+    def bench_presence(self, users=100000, servers=2000, servers_per_user=3, updates=500):
+        """Presence routing cost at 100k connected users: list scan vs membership index"""
+        rows = asyncio.run(self._presence_churn(users, servers, servers_per_user, updates))
+        self.report("Presence fan-out routing", rows)
+        return rows
+
+    def _start_workers(self, count, base_port, backend):
+        backend_dir = os.path.dirname(server.__file__)
+        workers = []
+        for i in range(count):
+            env = dict(os.environ, MONGO_URL=BENCH_MONGO_URL, BROADCAST_BACKEND=backend, NODE_ID=f"worker-{i}")
+            workers.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "server:app", "--port", str(base_port + i), "--log-level", "warning"],
+                cwd=backend_dir, env=env
+            ))
+        return workers
+
+    async def _wait_ready(self, urls, timeout=30):
+        import requests
+        deadline = time.monotonic() + timeout
+        pending = list(urls)
+        while pending and time.monotonic() < deadline:
+            try:
+                await asyncio.to_thread(requests.get, f"{pending[0]}/api/health", timeout=1)
+                pending.pop(0)
+            except requests.RequestException:
+                await asyncio.sleep(0.2)
+        return not pending
+
+    async def _multi_worker(self, count, base_port, backend):
+        import requests
+        import websockets
+
+        urls = [f"http://127.0.0.1:{base_port + i}" for i in range(count)]
+        workers = self._start_workers(count, base_port, backend)
+        try:
+            if not await self._wait_ready(urls):
+                return None
+
+            def post(url, path, data, token=None):
+                headers = {"Authorization": f"Bearer {token}"} if token else {}
+                response = requests.post(f"{url}/api/{path}", json=data, headers=headers, timeout=10)
+                response.raise_for_status()
+                return response.json()
+
+            tokens, user_ids = [], []
+            for i in range(count):
+                name = f"mw_{uuid.uuid4().hex[:10]}"
+                auth = await asyncio.to_thread(post, urls[i], "auth/register",
+                                               {"username": name, "email": f"{name}@bench.local", "password": "bench-pw"})
+                tokens.append(auth["access_token"])
+                user_ids.append(auth["user"]["user_id"])
+            created = await asyncio.to_thread(post, urls[0], "servers", {"name": "multi-worker"}, tokens[0])
+            server_id, channel_id = created["server_id"], created["channels"][0]
+            for i in range(1, count):
+                await asyncio.to_thread(post, urls[0], f"servers/{server_id}/members", {"user_id": user_ids[i]}, tokens[0])
+
+            # One socket per worker, all joined to the same server
+            sockets = []
+            for i in range(count):
+                ws = await websockets.connect(f"{urls[i].replace('http', 'ws')}/ws/{user_ids[i]}?token={tokens[i]}")
+                await ws.send(json.dumps({"type": "join_server", "server_id": server_id}))
+                sockets.append(ws)
+            await asyncio.sleep(0.5)
+
+            async def receive_message(ws):
+                while True:
+                    event = json.loads(await ws.recv())
+                    if event["type"] == "new_message":
+                        return time.perf_counter()
+
+            waiters = [asyncio.create_task(asyncio.wait_for(receive_message(ws), 10)) for ws in sockets]
+            start = time.perf_counter()
+            await asyncio.to_thread(post, urls[0], "messages", {"content": "hello workers", "channel_id": channel_id}, tokens[0])
+            results = await asyncio.gather(*waiters, return_exceptions=True)
+            for ws in sockets:
+                await ws.close()
+
+            rows = []
+            for i, result in enumerate(results):
+                delivered = not isinstance(result, BaseException)
+                rows.append({
+                    "worker": i,
+                    "backend": backend,
+                    "delivered": delivered,
+                    "latency_ms": round((result - start) * 1000, 2) if delivered else None,
+                })
+            return rows
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.wait()
+
+    def bench_multi_worker(self, workers=3, base_port=8101, backend=os.environ.get("BROADCAST_BACKEND", "mongo")):
+        """A message posted on one worker reaches sockets held by every worker"""
+        if asyncio.run(self._bench_db()) is None:
+            return []
+        rows = asyncio.run(self._multi_worker(workers, base_port, backend))
+        if rows is None:
+            self.fail("Multi-worker broadcast", f"{workers} workers did not become ready")
+            return []
+        self.report("Multi-worker broadcast", rows)
+        delivered = sum(1 for row in rows if row["delivered"])
+        if delivered != len(rows):
+            self.fail("Multi-worker broadcast", f"delivered on {delivered}/{len(rows)} workers")
+        else:
+            print(f"✅ Delivered on {delivered}/{len(rows)} workers")
+        return rows
+
+
+def main():
+    bench = XalvionBenchmark()
+    selected = sys.argv[1:] or [name[len("bench_"):] for name in dir(bench) if name.startswith("bench_")]
+
+    for name in selected:
+        getattr(bench, f"bench_{name}")()
+
+    with open("bench_output.txt", "w") as f:
+        json.dump(bench.results, f, indent=2)
+    print("\n✅ Results written to bench_output.txt")
+    if bench.failures:
+        print(f"\n❌ {len(bench.failures)} check(s) failed:")
+        for failure in bench.failures:
+            print(f"   {failure}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
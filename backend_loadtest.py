@@ -0,0 +1,522 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# Limits high enough that the scenarios measure the server, not the rate limiter
+LOADTEST_RATE_LIMITS = ",".join(f"{route}=1000000/1000000" for route in (
+    "messages", "reactions", "ws_frame", "typing", "presence_update", "join_server"))
+
+
+def summarize(samples):
+    """count/p50/p99/max in milliseconds for a list of second-valued samples"""
+    if not samples:
+        return {"count": 0, "p50_ms": None, "p99_ms": None, "max_ms": None}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))] * 1000, 3)
+
+    return {"count": len(ordered), "p50_ms": pct(50), "p99_ms": pct(99), "max_ms": round(ordered[-1] * 1000, 3)}
+
+
+def serve(port, mongomock):
+    """Run the app in this process; used as the load-test server subprocess"""
+    sys.path.insert(0, BACKEND_DIR)
+    import server
+    import uvicorn
+    if mongomock:
+        from mongomock_motor import AsyncMongoMockClient
+        server.db = AsyncMongoMockClient().xalvion_db
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def raise_file_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+class DeliveryTracker:
+    """Matches received events back to the moment their marker was sent"""
+
+    def __init__(self):
+        self.sent = {}
+        self.last = {}
+        self.latencies = []
+        self.delivered = 0
+        self.expected = 0
+        self.done = asyncio.Event()
+
+    def send(self, marker, recipients):
+        self.sent[marker] = time.perf_counter()
+        self.expected += recipients
+
+    def deliver(self, marker, received_at):
+        sent_at = self.sent.get(marker)
+        if sent_at is None:
+            return
+        self.latencies.append(received_at - sent_at)
+        self.last[marker] = received_at
+        self.delivered += 1
+        if self.expected and self.delivered >= self.expected:
+            self.done.set()
+
+    def fanout_times(self):
+        return [self.last[marker] - sent_at for marker, sent_at in self.sent.items() if marker in self.last]
+
+
+class SimClient:
+    """One simulated user holding a single WebSocket session"""
+
+    def __init__(self, tester, user):
+        self.tester = tester
+        self.user = user
+        self.session_id = uuid.uuid4().hex
+        self.ws = None
+        self.reader = None
+        self.hello = None
+        self.resumed = None
+        self.epoch = None
+        self.positions = {}
+        self.received = defaultdict(int)
+
+    async def connect(self):
+        import websockets
+        loop = asyncio.get_running_loop()
+        self.hello = loop.create_future()
+        self.resumed = loop.create_future()
+        self.ws = await websockets.connect(self.tester.ws_url(self.user, self.session_id),
+                                           max_size=None, open_timeout=60, ping_interval=None)
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        import websockets
+        try:
+            async for raw in self.ws:
+                received_at = time.perf_counter()
+                event = json.loads(raw)
+                if "seq" in event:
+                    self.positions[event["server_id"]] = event["seq"]
+                self.received[event["type"]] += 1
+                self.tester.observe(self, event, received_at)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send(self, payload):
+        await self.ws.send(json.dumps(payload))
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            await self.reader
+
+
+class LoadTester:
+    def __init__(self, base_url, clients, concurrency=200):
+        self.base_url = base_url
+        self.clients = clients
+        self.concurrency = concurrency
+        self.run_id = uuid.uuid4().hex[:8]
+        self.http = None
+        self.users = []
+        self.results = {}
+        self.messages = None
+        self.presence = None
+
+    def ws_url(self, user, session_id):
+        return (f"{self.base_url.replace('http', 'ws', 1)}/ws/{user['user_id']}"
+                f"?session={session_id}&token={user['token']}")
+
+    def report(self, name, result):
+        self.results[name] = result
+        print(f"\n📊 {name}")
+        for key, value in result.items():
+            print(f"   {key}: {value}")
+
+    def observe(self, client, event, received_at):
+        kind = event["type"]
+        if kind == "hello":
+            if not client.hello.done():
+                client.hello.set_result(received_at)
+            client.epoch = event["data"]["epoch"]
+        elif kind in ("resumed", "resync_required"):
+            if not client.resumed.done():
+                client.resumed.set_result((kind, received_at))
+        elif kind == "new_message" and self.messages is not None:
+            self.messages.deliver(event["data"]["content"], received_at)
+        elif kind == "presence_batch" and self.presence is not None:
+            for update in event["data"]["updates"]:
+                self.presence.deliver(update["presence"].get("activity"), received_at)
+
+    async def _bounded(self, coros):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(coro):
+            async with semaphore:
+                return await coro
+
+        return await asyncio.gather(*(run(coro) for coro in coros), return_exceptions=True)
+
+    async def post(self, path, data, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        started = time.perf_counter()
+        response = await self.http.post(f"{self.base_url}/api/{path}", json=data, headers=headers)
+        return response, time.perf_counter() - started
+
+    async def setup_users(self):
+        if len(self.users) >= self.clients:
+            return self.users[:self.clients]
+
+        import httpx
+
+        async def register():
+            for attempt in range(10):
+                # Fresh name per attempt: a dropped response may still have registered the last one
+                name = f"lt_{self.run_id}_{uuid.uuid4().hex[:8]}"
+                try:
+                    response, _ = await self.post("auth/register",
+                                                  {"username": name, "email": f"{name}@load.test", "password": "load-pw"})
+                except httpx.TransportError:
+                    if attempt == 9:
+                        raise
+                    await asyncio.sleep(0.5)
+                    continue
+                if response.status_code != 429:
+                    break
+                # bcrypt backpressure: setup should wait, not fail
+                await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+            response.raise_for_status()
+            auth = response.json()
+            return {"username": name, "user_id": auth["user"]["user_id"], "token": auth["access_token"]}
+
+        created = await self._bounded(register() for _ in range(len(self.users), self.clients))
+        self.users.extend(user for user in created if not isinstance(user, BaseException))
+        failures = [result for result in created if isinstance(result, BaseException)]
+        if failures:
+            raise RuntimeError(f"{len(failures)} registrations failed, first: {failures[0]!r}")
+        return self.users
+
+    async def hot_server(self):
+        # One server everybody joins, so every event fans out to every client
+        response, _ = await self.post("servers", {"name": f"hot-{self.run_id}"}, self.users[0]["token"])
+        response.raise_for_status()
+        created = response.json()
+        # Sockets may only join servers their user is a member of, and only the owner adds members
+        owner_token = self.users[0]["token"]
+        results = await self._bounded(self.post(f"servers/{created['server_id']}/members",
+                                                {"user_id": user["user_id"]}, owner_token)
+                                      for user in self.users[1:self.clients])
+        failures = [result if isinstance(result, BaseException) else result[0] for result in results
+                    if isinstance(result, BaseException) or result[0].is_error]
+        if failures:
+            raise RuntimeError(f"{len(failures)} member additions failed, first: {failures[0]!r}")
+        return created["server_id"], created["channels"][0]
+
+    async def connect_all(self, server_id=None):
+        clients = [SimClient(self, user) for user in self.users[:self.clients]]
+        started = time.perf_counter()
+        results = await self._bounded(client.connect() for client in clients)
+        failed = sum(1 for result in results if isinstance(result, BaseException))
+        clients = [client for client, result in zip(clients, results) if not isinstance(result, BaseException)]
+        await asyncio.wait_for(asyncio.gather(*(client.hello for client in clients)), 60)
+        if server_id:
+            await asyncio.gather(*(client.send({"type": "join_server", "server_id": server_id})
+                                   for client in clients))
+            # Let the user_joined storm drain before measuring anything
+            await asyncio.sleep(1 + len(clients) / 2000)
+        return clients, failed, time.perf_counter() - started
+
+    async def close_all(self, clients):
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+    async def scenario_login_storm(self):
+        """Every client logs in at once"""
+        users = await self.setup_users()
+        started = time.perf_counter()
+        results = await self._bounded(
+            self.post("auth/login", {"username": user["username"], "password": "load-pw"}) for user in users)
+        elapsed = time.perf_counter() - started
+        statuses = defaultdict(int)
+        latencies = []
+        for result in results:
+            if isinstance(result, BaseException):
+                statuses["error"] += 1
+                continue
+            response, latency = result
+            statuses[str(response.status_code)] += 1
+            if response.status_code == 200:
+                latencies.append(latency)
+        return {
+            "logins": len(users),
+            "throughput_per_sec": round(len(latencies) / elapsed, 1),
+            "statuses": dict(statuses),
+            "latency": summarize(latencies),
+        }
+
+    async def scenario_message_burst(self, messages=200, senders=20):
+        """Senders post into one hot channel watched by every client"""
+        await self.setup_users()
+        server_id, channel_id = await self.hot_server()
+        clients, failed, _ = await self.connect_all(server_id)
+        self.messages = DeliveryTracker()
+        semaphore = asyncio.Semaphore(senders)
+
+        async def send(i):
+            user = self.users[i % len(self.users)]
+            marker = f"lt:{self.run_id}:{i}"
+            async with semaphore:
+                self.messages.send(marker, len(clients))
+                response, latency = await self.post("messages", {"content": marker, "channel_id": channel_id},
+                                                    user["token"])
+                return response.status_code, latency
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(send(i) for i in range(messages)), return_exceptions=True)
+        post_elapsed = time.perf_counter() - started
+        try:
+            await asyncio.wait_for(self.messages.done.wait(), 30)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+        tracker, self.messages = self.messages, None
+        await self.close_all(clients)
+
+        ok = [latency for result in results if not isinstance(result, BaseException)
+              for status, latency in [result] if status == 200]
+        return {
+            "clients": len(clients),
+            "connect_failures": failed,
+            "messages": messages,
+            "posts_per_sec": round(len(ok) / post_elapsed, 1),
+            "post_latency": summarize(ok),
+            "deliveries": tracker.delivered,
+            "expected_deliveries": tracker.expected,
+            "deliveries_per_sec": round(tracker.delivered / elapsed, 1),
+            "delivery_latency": summarize(tracker.latencies),
+            "fanout_completion": summarize(tracker.fanout_times()),
+        }
+
+    async def scenario_typing_flood(self, duration=5.0, rate=2.0):
+        """Every client sends typing frames into the same channel"""
+        await self.setup_users()
+        server_id, channel_id = await self.hot_server()
+        clients, failed, _ = await self.connect_all(server_id)
+        before = sum(client.received["typing_users"] for client in clients)
+        sent = 0
+
+        async def type_loop(client):
+            nonlocal sent
+            deadline = time.perf_counter() + duration
+            typing = True
+            while time.perf_counter() < deadline:
+                await client.send({"type": "typing" if typing else "stop_typing", "channel_id": channel_id,
+                                   "username": client.user["username"]})
+                sent += 1
+                typing = not typing
+                await asyncio.sleep(1 / rate)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(type_loop(client) for client in clients))
+        await asyncio.sleep(1)
+        elapsed = time.perf_counter() - started
+        received = sum(client.received["typing_users"] for client in clients) - before
+        await self.close_all(clients)
+        return {
+            "clients": len(clients),
+            "connect_failures": failed,
+            "frames_sent": sent,
+            "frames_per_sec": round(sent / elapsed, 1),
+            "typing_events_received": received,
+            "received_per_client_per_sec": round(received / max(1, len(clients)) / elapsed, 2),
+            # Without aggregation every frame would reach every client
+            "amplification": round(received / max(1, sent), 3),
+        }
+
+    async def scenario_presence_churn(self, duration=5.0, rate=1.0):
+        """Every client keeps changing its activity; others see presence batches"""
+        await self.setup_users()
+        server_id, _ = await self.hot_server()
+        clients, failed, _ = await self.connect_all(server_id)
+        self.presence = DeliveryTracker()
+        sent = 0
+
+        async def churn(client):
+            nonlocal sent
+            deadline = time.perf_counter() + duration
+            n = 0
+            while time.perf_counter() < deadline:
+                marker = f"p:{client.session_id}:{n}"
+                self.presence.send(marker, len(clients))
+                await client.send({"type": "presence_update", "data": {"status": "online", "activity": marker}})
+                sent += 1
+                n += 1
+                await asyncio.sleep(1 / rate)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(churn(client) for client in clients))
+        await asyncio.sleep(1)
+        elapsed = time.perf_counter() - started
+        tracker, self.presence = self.presence, None
+        batches = sum(client.received["presence_batch"] for client in clients)
+        await self.close_all(clients)
+        return {
+            "clients": len(clients),
+            "connect_failures": failed,
+            "updates_sent": sent,
+            "updates_per_sec": round(sent / elapsed, 1),
+            "batches_received": batches,
+            "updates_delivered": tracker.delivered,
+            "delivery_latency": summarize(tracker.latencies),
+        }
+
+    async def scenario_reconnect_storm(self):
+        """Every socket drops at once and reconnects with its session id and resume positions"""
+        await self.setup_users()
+        server_id, channel_id = await self.hot_server()
+        clients, failed, _ = await self.connect_all(server_id)
+        # Give the stream a position worth resuming from
+        await self.post("messages", {"content": f"before-storm-{self.run_id}", "channel_id": channel_id},
+                        self.users[0]["token"])
+        await asyncio.sleep(1)
+        await self.close_all(clients)
+
+        async def reconnect(client):
+            epoch, positions = client.epoch, dict(client.positions)
+            started = time.perf_counter()
+            await client.connect()
+            hello_at = await asyncio.wait_for(client.hello, 60)
+            await client.send({"type": "resume", "epoch": epoch, "positions": positions})
+            outcome, resumed_at = await asyncio.wait_for(client.resumed, 60)
+            return hello_at - started, resumed_at - started, outcome
+
+        started = time.perf_counter()
+        results = await self._bounded(reconnect(client) for client in clients)
+        elapsed = time.perf_counter() - started
+        ok = [result for result in results if not isinstance(result, BaseException)]
+        outcomes = defaultdict(int)
+        for _, _, outcome in ok:
+            outcomes[outcome] += 1
+        health = (await self.http.get(f"{self.base_url}/api/health")).json()
+        await self.close_all(clients)
+        return {
+            "clients": len(clients),
+            "connect_failures": failed,
+            "reconnected": len(ok),
+            "reconnect_failures": len(results) - len(ok),
+            "reconnects_per_sec": round(len(ok) / elapsed, 1),
+            "hello_latency": summarize([hello for hello, _, _ in ok]),
+            "resume_latency": summarize([resumed for _, resumed, _ in ok]),
+            "outcomes": dict(outcomes),
+            "server_sessions_after": health.get("connections", {}).get("sessions"),
+        }
+
+    async def run(self, scenarios):
+        import httpx
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=60) as http:
+            self.http = http
+            for name in scenarios:
+                print(f"\n🚀 {name} ({self.clients} clients)")
+                try:
+                    self.report(name, await getattr(self, f"scenario_{name}")())
+                except Exception as e:
+                    print(f"❌ {name} failed: {e!r}")
+                    self.results[name] = {"error": repr(e)}
+        return self.results
+
+
+async def wait_ready(base_url, timeout=30):
+    import httpx
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=1) as http:
+        while time.monotonic() < deadline:
+            try:
+                await http.get(f"{base_url}/api/health")
+                return True
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    return False
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    scenarios = [name[len("scenario_"):] for name in dir(LoadTester) if name.startswith("scenario_")]
+    parser = argparse.ArgumentParser(description="Xalvion REST and WebSocket load test")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run (default: all of {', '.join(scenarios)})")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200, help="max in-flight HTTP requests / connects")
+    parser.add_argument("--url", help="test an already running server instead of starting one")
+    parser.add_argument("--mongomock", action="store_true", help="start the server on an in-memory mongomock db")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--port", type=int, default=8201)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="server bcrypt cost for the test users")
+    parser.add_argument("--output", default="loadtest_output.json")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    unknown = sorted(set(args.scenarios) - set(scenarios))
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    if args.serve:
+        serve(args.port, args.mongomock)
+        return 0
+
+    raise_file_limit()
+    base_url = args.url
+    process = None
+    if not base_url:
+        base_url = f"http://127.0.0.1:{args.port}"
+        env = dict(os.environ, MONGO_URL=args.mongo_url, BCRYPT_ROUNDS=str(args.bcrypt_rounds))
+        env.setdefault("RATE_LIMITS", LOADTEST_RATE_LIMITS)
+        command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port)]
+        if args.mongomock:
+            command.append("--mongomock")
+        process = subprocess.Popen(command, env=env)
+
+    try:
+        if not asyncio.run(wait_ready(base_url)):
+            print(f"❌ Server at {base_url} did not become ready")
+            return 1
+        tester = LoadTester(base_url, args.clients, args.concurrency)
+        results = asyncio.run(tester.run(args.scenarios or scenarios))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    output = {
+        "run_at": datetime.utcnow().isoformat(),
+        "revision": git_revision(),
+        "backend": "external" if args.url else ("mongomock" if args.mongomock else args.mongo_url),
+        "clients": args.clients,
+        "bcrypt_rounds": args.bcrypt_rounds,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+    return 0 if all("error" not in result for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -300,6 +300,78 @@ class XalvionAPITester:
             }))
             print(f"Joined server: {self.server_id} via WebSocket")
 
+    def ws_url(self, user_id, token=None):
+        """WebSocket URL for user_id, authenticated with our access token by default"""
+        url = f"{self.base_url.replace('http', 'ws')}/ws/{user_id}?session={uuid.uuid4().hex}"
+        token = self.token if token is None else token
+        return f"{url}&token={token}" if token else url
+
+    def ws_close_code(self, ws_url):
+        """Connect and return the close code the server ends the handshake with"""
+        ws = websocket.create_connection(ws_url, timeout=10)
+        try:
+            opcode, data = ws.recv_data(control_frame=True)
+        finally:
+            ws.close()
+        if opcode == websocket.ABNF.OPCODE_CLOSE and len(data) >= 2:
+            return int.from_bytes(data[:2], "big")
+        return None
+
+    def test_websocket_handshake(self, name, ws_url, expected_code):
+        """Test that a WebSocket handshake is refused with expected_code"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing {name}...")
+        try:
+            code = self.ws_close_code(ws_url)
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+        if code != expected_code:
+            print(f"❌ Failed - Expected close code {expected_code}, got {code}")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Passed - Close code: {code}")
+        return True
+
+    def test_websocket_missing_token(self):
+        """Test that a WebSocket without a token is closed with 4401"""
+        return self.test_websocket_handshake("WebSocket Without Token", self.ws_url(self.user_id, token=""), 4401)
+
+    def test_websocket_wrong_user(self):
+        """Test that a token for another user_id is closed with 4403"""
+        return self.test_websocket_handshake("WebSocket Wrong User", self.ws_url(str(uuid.uuid4())), 4403)
+
+    def test_websocket_forbidden_frames(self):
+        """Test that join_server and typing for foreign ids are refused"""
+        self.tests_run += 1
+        print("\n🔍 Testing WebSocket Forbidden Frames...")
+        frames = [
+            {"type": "join_server", "server_id": str(uuid.uuid4())},
+            {"type": "typing", "channel_id": str(uuid.uuid4())}
+        ]
+        ws = None
+        try:
+            ws = websocket.create_connection(self.ws_url(self.user_id), timeout=10)
+            for frame in frames:
+                ws.send(json.dumps(frame))
+                while True:
+                    event = json.loads(ws.recv())
+                    if event["type"] == "forbidden":
+                        break
+                if event["data"]["type"] != frame["type"]:
+                    print(f"❌ Failed - Expected forbidden {frame['type']}, got {event['data']}")
+                    return False
+                print(f"Refused {frame['type']}")
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+        finally:
+            if ws:
+                ws.close()
+        self.tests_passed += 1
+        print("✅ Passed - Both frames refused")
+        return True
+
     def test_websocket(self):
         """Test WebSocket connection"""
         if not self.user_id:
@@ -307,10 +379,11 @@ class XalvionAPITester:
             return False
             
         print("\n🔍 Testing WebSocket connection...")
+        self.tests_run += 1
         
         try:
-            ws_url = f"{self.base_url.replace('http', 'ws')}/ws/{self.user_id}"
-            print(f"Connecting to WebSocket: {ws_url}")
+            ws_url = self.ws_url(self.user_id)
+            print(f"Connecting to WebSocket: {ws_url.split('&token=')[0]}")
             
             self.ws = websocket.WebSocketApp(
                 ws_url,
@@ -333,8 +406,7 @@ class XalvionAPITester:
                 if self.ws.sock and self.ws.sock.connected:
                     self.ws.send(json.dumps({
                         "type": "typing",
-                        "channel_id": self.channel_id,
-                        "username": self.username
+                        "channel_id": self.channel_id
                     }))
                     print("Sent typing indicator")
                     time.sleep(1)
@@ -397,8 +469,11 @@ def main():
     messages_list_ok = tester.test_get_messages()
     reaction_ok = tester.test_add_reaction()
     
-    # WebSocket test
+    # WebSocket tests
     websocket_ok = tester.test_websocket()
+    ws_missing_token_ok = tester.test_websocket_missing_token()
+    ws_wrong_user_ok = tester.test_websocket_wrong_user()
+    ws_forbidden_ok = tester.test_websocket_forbidden_frames()
     
     # Print results
     print("\n📊 Test Results:")
@@ -418,6 +493,9 @@ def main():
     print(f"List Messages: {'✅' if messages_list_ok else '❌'}")
     print(f"Add Reaction: {'✅' if reaction_ok else '❌'}")
     print(f"WebSocket: {'✅' if websocket_ok else '❌'}")
+    print(f"WebSocket Without Token: {'✅' if ws_missing_token_ok else '❌'}")
+    print(f"WebSocket Wrong User: {'✅' if ws_wrong_user_ok else '❌'}")
+    print(f"WebSocket Forbidden Frames: {'✅' if ws_forbidden_ok else '❌'}")
     
     return 0 if tester.tests_passed == tester.tests_run else 1
 
@@ -28,9 +28,14 @@ function App() {
   const [showCreateChannel, setShowCreateChannel] = useState(false);
   const [newChannel, setNewChannel] = useState({ name: '', channel_type: 'text', description: '' });
   const [emojiPicker, setEmojiPicker] = useState({ show: false, messageId: null });
+  const [resyncCount, setResyncCount] = useState(0);
   
   const messagesEndRef = useRef(null);
   const typingTimeoutRef = useRef(null);
+  // The server forgets a typist after typing_ttl seconds without a "typing" frame
+  const typingRef = useRef({ ttl: 6, lastSent: 0 });
+  const typingNodesRef = useRef({});
+  const streamRef = useRef({ epoch: null, positions: {}, resuming: {} });
   const messageInputRef = useRef(null);
 
   // Available emojis
@@ -43,6 +48,27 @@ function App() {
     }
   }, [token]);
 
+  // Access tokens are short-lived; swap the refresh token for a new pair a minute early
+  useEffect(() => {
+    if (!token) return;
+    const expiresAt = Number(localStorage.getItem('xalvion_token_expires_at')) || 0;
+    const timer = setTimeout(refreshSession, Math.max(5000, expiresAt - Date.now() - 60000));
+    return () => clearTimeout(timer);
+  }, [token]);
+
+  // Another tab refreshed or logged out: follow it, which also reschedules the timer above
+  useEffect(() => {
+    const onStorage = (event) => {
+      if (event.key !== 'xalvion_token') return;
+      setToken(event.newValue);
+      if (!event.newValue) {
+        setShowLogin(true);
+      }
+    };
+    window.addEventListener('storage', onStorage);
+    return () => window.removeEventListener('storage', onStorage);
+  }, []);
+
   useEffect(() => {
     if (user && !ws) {
       connectWebSocket();
@@ -61,6 +87,12 @@ function App() {
     }
   }, [activeChannel]);
 
+  useEffect(() => {
+    if (activeChannel && resyncCount > 0) {
+      fetchMessages(activeChannel.channel_id);
+    }
+  }, [resyncCount]);
+
   useEffect(() => {
     scrollToBottom();
   }, [messages]);
@@ -69,10 +101,22 @@ function App() {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
+  // Stable per-tab id so a reconnect replaces this tab's old socket only
+  const getSessionId = () => {
+    let sessionId = sessionStorage.getItem('xalvion_session');
+    if (!sessionId) {
+      sessionId = window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+      sessionStorage.setItem('xalvion_session', sessionId);
+    }
+    return sessionId;
+  };
+
   const connectWebSocket = () => {
     if (!user) return;
     
-    const wsUrl = BACKEND_URL.replace('http', 'ws') + `/ws/${user.user_id}`;
+    // Read the token from storage: a reconnect may run long after a refresh
+    const accessToken = encodeURIComponent(localStorage.getItem('xalvion_token') || '');
+    const wsUrl = BACKEND_URL.replace('http', 'ws') + `/ws/${user.user_id}?session=${getSessionId()}&token=${accessToken}`;
     const websocket = new WebSocket(wsUrl);
     
     websocket.onopen = () => {
@@ -90,18 +134,104 @@ function App() {
     
     websocket.onmessage = (event) => {
       const message = JSON.parse(event.data);
+      const stream = streamRef.current;
+      
+      // Server events carry a per-server sequence; skip anything already seen
+      if (message.seq !== undefined) {
+        const last = stream.positions[message.server_id] || 0;
+        if (message.seq <= last) return;
+        if (last && message.seq > last + 1) {
+          // Frames were dropped for this slow socket: replay from the last one
+          // we have, which also redelivers this frame in order
+          if (!stream.resuming[message.server_id]) {
+            stream.resuming[message.server_id] = true;
+            websocket.send(JSON.stringify({
+              type: 'resume',
+              epoch: stream.epoch,
+              positions: { [message.server_id]: last }
+            }));
+          }
+          return;
+        }
+        stream.positions[message.server_id] = message.seq;
+      }
       
       switch (message.type) {
+        case 'hello':
+          // After a reconnect ask for just the missed events instead of reloading
+          if (stream.epoch && Object.keys(stream.positions).length > 0) {
+            websocket.send(JSON.stringify({
+              type: 'resume',
+              epoch: stream.epoch,
+              positions: stream.positions
+            }));
+          }
+          stream.epoch = message.data.epoch;
+          // Keep the gateway from reaping this socket as idle
+          clearInterval(websocket.heartbeat);
+          websocket.heartbeat = setInterval(() => {
+            if (websocket.readyState === WebSocket.OPEN) {
+              websocket.send(JSON.stringify({ type: 'heartbeat' }));
+            }
+          }, (message.data.heartbeat_interval || 25) * 1000);
+          typingRef.current.ttl = message.data.typing_ttl || typingRef.current.ttl;
+          break;
+        case 'heartbeat_ack':
+          break;
+        case 'rate_limited':
+          console.warn(`Rate limited on ${message.data.route}, retry in ${message.data.retry_after}s`);
+          break;
+        case 'forbidden':
+          console.warn(`Not allowed: ${message.data.type} ${message.data.target}`);
+          break;
+        case 'resumed':
+          stream.resuming = {};
+          break;
+        case 'resync_required':
+          if (message.data.server_id) {
+            delete stream.positions[message.data.server_id];
+          } else {
+            stream.positions = {};
+          }
+          stream.resuming = {};
+          setResyncCount(count => count + 1);
+          break;
         case 'new_message':
           setMessages(prev => [...prev, message.data]);
           break;
+        case 'message_deleted':
+          setMessages(prev => prev.filter(msg => msg.message_id !== message.data.message_id));
+          break;
         case 'reaction_update':
           setMessages(prev => prev.map(msg => 
             msg.message_id === message.data.message_id 
-              ? { ...msg, reactions: message.data.reactions }
+              ? {
+                  ...msg,
+                  reaction_counts: {
+                    ...(msg.reaction_counts || {}),
+                    [message.data.emoji]: message.data.count
+                  }
+                }
               : msg
           ));
           break;
+        case 'typing_users': {
+          // Each backend worker reports its own typers; merge them per channel
+          const { channel_id, node, users } = message.data;
+          const channelNodes = typingNodesRef.current[channel_id] || {};
+          channelNodes[node || 'default'] = users;
+          typingNodesRef.current[channel_id] = channelNodes;
+          setTypingUsers(prev => ({
+            ...prev,
+            [channel_id]: Object.fromEntries(
+              Object.values(channelNodes)
+                .flat()
+                .filter(typingUser => typingUser.user_id !== user.user_id)
+                .map(typingUser => [typingUser.user_id, typingUser.username])
+            )
+          }));
+          break;
+        }
         case 'typing':
           if (message.data.user_id !== user.user_id) {
             setTypingUsers(prev => ({
@@ -128,6 +258,14 @@ function App() {
             [message.data.user_id]: message.data.presence
           }));
           break;
+        case 'presence_batch':
+          setUserPresence(prev => ({
+            ...prev,
+            ...Object.fromEntries(
+              message.data.updates.map(update => [update.user_id, update.presence])
+            )
+          }));
+          break;
         case 'presence_update':
           setUserPresence(prev => ({
             ...prev,
@@ -137,14 +275,79 @@ function App() {
       }
     };
     
-    websocket.onclose = () => {
+    websocket.onclose = async (event) => {
       console.log('WebSocket disconnected');
+      clearInterval(websocket.heartbeat);
       setWs(null);
+      // 4401: the access token was expired or revoked
+      if (event.code === 4401 && !(await refreshSession())) {
+        return;
+      }
       // Reconnect after 3 seconds
       setTimeout(connectWebSocket, 3000);
     };
   };
 
+  const storeSession = (data) => {
+    localStorage.setItem('xalvion_refresh_token', data.refresh_token);
+    localStorage.setItem('xalvion_token_expires_at', String(Date.now() + data.expires_in * 1000));
+    // Written last: other tabs react to this key and read the other two
+    localStorage.setItem('xalvion_token', data.access_token);
+    setToken(data.access_token);
+  };
+
+  const clearSession = () => {
+    localStorage.removeItem('xalvion_token');
+    localStorage.removeItem('xalvion_refresh_token');
+    localStorage.removeItem('xalvion_token_expires_at');
+    setToken(null);
+  };
+
+  // Refresh tokens are single-use and shared by every tab; presenting one that
+  // another tab already rotated counts as reuse and revokes the whole session.
+  // So refreshes are serialized across tabs with a Web Lock, and a tab that
+  // finds the token rotated while it waited adopts the new pair instead.
+  const refreshSession = async () => {
+    const seenRefreshToken = localStorage.getItem('xalvion_refresh_token');
+    const adoptRotated = () => {
+      const current = localStorage.getItem('xalvion_refresh_token');
+      if (current && current !== seenRefreshToken) {
+        setToken(localStorage.getItem('xalvion_token'));
+        return true;
+      }
+      return false;
+    };
+    const refresh = async () => {
+      if (adoptRotated()) return true;
+      if (seenRefreshToken) {
+        try {
+          const response = await fetch(`${BACKEND_URL}/api/auth/refresh`, {
+            method: 'POST',
+            headers: {
+              'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ refresh_token: seenRefreshToken })
+          });
+          if (response.ok) {
+            storeSession(await response.json());
+            return true;
+          }
+        } catch (error) {
+          console.error('Error refreshing session:', error);
+        }
+      }
+      // Without Web Locks another tab may still have won the race
+      if (adoptRotated()) return true;
+      clearSession();
+      setShowLogin(true);
+      return false;
+    };
+    if (navigator.locks) {
+      return navigator.locks.request('xalvion_refresh', refresh);
+    }
+    return refresh();
+  };
+
   const fetchUserProfile = async () => {
     try {
       const response = await fetch(`${BACKEND_URL}/api/user/profile`, {
@@ -158,9 +361,11 @@ function App() {
         setUser(userData);
         setTheme(userData.theme || 'dark');
         setCustomStatus(userData.custom_status || '');
+      } else if (response.status === 401) {
+        // Expired access token: the refreshed token re-runs this fetch
+        await refreshSession();
       } else {
-        localStorage.removeItem('xalvion_token');
-        setToken(null);
+        clearSession();
         setShowLogin(true);
       }
     } catch (error) {
@@ -168,19 +373,32 @@ function App() {
     }
   };
 
-  const fetchServers = async () => {
-    try {
-      const response = await fetch(`${BACKEND_URL}/api/servers`, {
+  // Listings are cursor-paginated; the browser revalidates each page with its ETag
+  const fetchAllPages = async (path, key) => {
+    const items = [];
+    let cursor = null;
+    do {
+      const url = `${BACKEND_URL}${path}${cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''}`;
+      const response = await fetch(url, {
         headers: {
           'Authorization': `Bearer ${token}`
         }
       });
-      
-      if (response.ok) {
-        const data = await response.json();
-        setServers(data.servers);
-        if (data.servers.length > 0 && !activeServer) {
-          setActiveServer(data.servers[0]);
+      if (!response.ok) return null;
+      const data = await response.json();
+      items.push(...data[key]);
+      cursor = data.next_cursor;
+    } while (cursor);
+    return items;
+  };
+
+  const fetchServers = async () => {
+    try {
+      const servers = await fetchAllPages('/api/servers', 'servers');
+      if (servers) {
+        setServers(servers);
+        if (servers.length > 0 && !activeServer) {
+          setActiveServer(servers[0]);
         }
       }
     } catch (error) {
@@ -190,17 +408,11 @@ function App() {
 
   const fetchChannels = async (serverId) => {
     try {
-      const response = await fetch(`${BACKEND_URL}/api/servers/${serverId}/channels`, {
-        headers: {
-          'Authorization': `Bearer ${token}`
-        }
-      });
-      
-      if (response.ok) {
-        const data = await response.json();
-        setChannels(data.channels);
-        if (data.channels.length > 0 && !activeChannel) {
-          setActiveChannel(data.channels[0]);
+      const channels = await fetchAllPages(`/api/servers/${serverId}/channels`, 'channels');
+      if (channels) {
+        setChannels(channels);
+        if (channels.length > 0 && !activeChannel) {
+          setActiveChannel(channels[0]);
         }
       }
     } catch (error) {
@@ -238,8 +450,7 @@ function App() {
       
       if (response.ok) {
         const data = await response.json();
-        setToken(data.access_token);
-        localStorage.setItem('xalvion_token', data.access_token);
+        storeSession(data);
         setUser(data.user);
         setShowLogin(false);
       } else {
@@ -263,8 +474,7 @@ function App() {
       
       if (response.ok) {
         const data = await response.json();
-        setToken(data.access_token);
-        localStorage.setItem('xalvion_token', data.access_token);
+        storeSession(data);
         setUser(data.user);
         setShowLogin(false);
       } else {
@@ -302,12 +512,15 @@ function App() {
   };
 
   const handleTyping = () => {
-    if (!isTyping && ws && activeChannel) {
+    // Re-announce every half TTL while still typing so the server keeps us listed
+    const typing = typingRef.current;
+    const now = Date.now();
+    if ((!isTyping || now - typing.lastSent >= typing.ttl * 500) && ws && activeChannel) {
       setIsTyping(true);
+      typing.lastSent = now;
       ws.send(JSON.stringify({
         type: 'typing',
-        channel_id: activeChannel.channel_id,
-        username: user.username
+        channel_id: activeChannel.channel_id
       }));
     }
     
@@ -399,6 +612,11 @@ function App() {
     }
   };
 
+  // Legacy `reactions` arrays are migrated by `server.py --backfill-reactions`
+  const getReactionCounts = (message) => {
+    return Object.entries(message.reaction_counts || {}).filter(([, count]) => count > 0);
+  };
+
   const formatTimestamp = (timestamp) => {
     return new Date(timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
   };
@@ -419,8 +637,16 @@ function App() {
   };
 
   const logout = () => {
-    localStorage.removeItem('xalvion_token');
-    setToken(null);
+    // Best effort: revoke both tokens server-side
+    fetch(`${BACKEND_URL}/api/auth/logout`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`
+      },
+      body: JSON.stringify({ refresh_token: localStorage.getItem('xalvion_refresh_token') })
+    }).catch(() => {});
+    clearSession();
     setUser(null);
     setShowLogin(true);
     if (ws) {
@@ -736,15 +962,9 @@ function App() {
                   
                   {/* Reactions */}
                   <div className="flex items-center space-x-2 mt-2">
-                    {message.reactions && message.reactions.length > 0 && (
+                    {getReactionCounts(message).length > 0 && (
                       <div className="flex space-x-1">
-                        {Object.entries(
-                          message.reactions.reduce((acc, reaction) => {
-                            acc[reaction.emoji] = acc[reaction.emoji] || [];
-                            acc[reaction.emoji].push(reaction);
-                            return acc;
-                          }, {})
-                        ).map(([emoji, reactions]) => (
+                        {getReactionCounts(message).map(([emoji, count]) => (
                           <span
                             key={emoji}
                             className={`px-2 py-1 rounded text-sm ${
@@ -753,7 +973,7 @@ function App() {
                                 : 'bg-gray-200 hover:bg-gray-300'
                             } cursor-pointer`}
                           >
-                            {emoji} {reactions.length}
+                            {emoji} {count}
                           </span>
                         ))}
                       </div>
@@ -0,0 +1,45 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor", reason="history buffer tests run against mongomock-motor")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+import server  # noqa: E402
+
+USERS = [{"user_id": f"u{i}", "username": f"user{i}"} for i in range(4)]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient().xalvion_test
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "REACTION_SAMPLE_SIZE", 2)
+    monkeypatch.setattr(server, "recent_messages", server.RecentMessageBuffer(size=10))
+    monkeypatch.setitem(server.manager.control_handlers, "history_reaction", server.recent_messages.apply_reaction)
+    asyncio.run(database.messages.insert_one({
+        "message_id": "m1", "channel_id": "c1", "user_id": "u0", "content": "hi",
+        "created_at": "2026-01-01T00:00:00", "reaction_counts": {}, "reaction_samples": {}
+    }))
+    return database
+
+
+def react(user, action):
+    reaction = server.MessageReaction(message_id="m1", emoji="👍", action=action)
+    return asyncio.run(server.add_reaction("m1", reaction, user))
+
+
+def test_buffered_page_tracks_reaction_samples(db):
+    assert asyncio.run(server.recent_messages.first_page("c1", 10))["messages"]
+    for user in USERS:
+        react(user, "add")
+    react(USERS[0], "remove")
+
+    buffered = asyncio.run(server.recent_messages.first_page("c1", 10))["messages"][0]
+    stored = asyncio.run(server.fetch_message_page("c1", 10))["messages"][0]
+    assert server.recent_messages.hits == 1
+    assert buffered["reaction_counts"] == stored["reaction_counts"] == {"👍": 3}
+    assert buffered["reaction_samples"] == stored["reaction_samples"]
+    assert [user["user_id"] for user in buffered["reaction_samples"]["👍"]] == ["u1"]
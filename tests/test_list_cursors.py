@@ -0,0 +1,52 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor", reason="listing tests run against mongomock-motor")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+import server  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+OWNER = {"user_id": "u0", "username": "owner"}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient().xalvion_test
+
+    async def is_member(server_id, user_id):
+        return True
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server.topology, "is_member", is_member)
+    members = [f"u{i}" for i in range(5)]
+    asyncio.run(database.servers.insert_one({"server_id": "s1", "members": members}))
+    asyncio.run(database.users.insert_many([{"user_id": u, "username": u} for u in members]))
+    return database
+
+
+def list_members(cursor=None, limit=2):
+    request = Request({"type": "http", "method": "GET", "headers": []})
+    response = asyncio.run(server.get_server_members("s1", request, limit, cursor, OWNER))
+    return json.loads(response.body)
+
+
+def test_member_cursor_pages_through_join_order(db):
+    first = list_members()
+    second = list_members(first["next_cursor"])
+    last = list_members(second["next_cursor"])
+    pages = [first, second, last]
+    assert [m["user_id"] for page in pages for m in page["members"]] == ["u0", "u1", "u2", "u3", "u4"]
+    assert last["next_cursor"] is None
+
+
+@pytest.mark.parametrize("offset", [True, False, -1, 1.0, "2", None])
+def test_member_cursor_rejects_non_integer_offsets(db, offset):
+    with pytest.raises(HTTPException) as excinfo:
+        list_members(server.encode_list_cursor([offset]))
+    assert excinfo.value.status_code == 400
+    assert excinfo.value.detail == "Invalid cursor"
@@ -0,0 +1,19 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend_benchmark  # noqa: E402
+
+
+def test_message_reaches_sockets_on_every_worker():
+    bench = backend_benchmark.XalvionBenchmark()
+    if asyncio.run(bench._bench_db()) is None:
+        pytest.skip(f"needs a MongoDB shared by the workers at {backend_benchmark.BENCH_MONGO_URL}")
+    backend = os.environ.get("BROADCAST_BACKEND", "mongo")
+    rows = asyncio.run(bench._multi_worker(3, 8101, backend))
+    assert rows is not None, "workers did not become ready"
+    undelivered = [row["worker"] for row in rows if not row["delivered"]]
+    assert not undelivered, f"new_message never reached workers {undelivered} over the {backend} bus"
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+import server  # noqa: E402
+
+RULES = {"ws_frame": (1.0, 1), "typing": (0.5, 1)}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+    monkeypatch.setattr(time, "monotonic", lambda: 1000.0)
+    monkeypatch.setattr(server.asyncio, "sleep", sleep)
+    return slept
+
+
+def limiter(monkeypatch, policy):
+    rate_limiter = server.RateLimiter(rules=RULES, policy=policy, max_delay=5)
+    monkeypatch.setattr(server, "rate_limiter", rate_limiter)
+    return rate_limiter
+
+
+def admit(message_type):
+    connection = SimpleNamespace(rate_key="u1:s1", user_id="u1")
+    return asyncio.run(server.admit_frame(connection, message_type))
+
+
+def test_delayed_frame_is_charged_to_its_type_bucket(monkeypatch, sleeps):
+    rate_limiter = limiter(monkeypatch, "delay")
+    assert admit("typing") and sleeps == []
+
+    # The connection bucket alone would delay by 1s; typing refills at 0.5/s
+    assert admit("typing")
+    assert sleeps == [2.0]
+    assert rate_limiter.buckets[("typing", "u1")][0] == -1
+    assert rate_limiter.stats == {"allowed": 1, "delayed": 1, "rejected": 0, "disconnected": 0}
+
+
+def test_frame_without_a_type_rule_waits_on_the_connection_bucket(monkeypatch, sleeps):
+    rate_limiter = limiter(monkeypatch, "delay")
+    admit("typing")
+    assert admit("heartbeat")
+    assert sleeps == [1.0]
+    assert rate_limiter.buckets[("typing", "u1")][0] == 0
+
+
+def test_rejected_frame_leaves_the_type_bucket_alone(monkeypatch, sleeps):
+    rate_limiter = limiter(monkeypatch, "reject")
+    connection = SimpleNamespace(rate_key="u1:s1", user_id="u1", enqueue=lambda *args, **kwargs: None)
+    assert asyncio.run(server.admit_frame(connection, "typing"))
+    assert not asyncio.run(server.admit_frame(connection, "typing"))
+    assert rate_limiter.buckets[("typing", "u1")][0] == 0
+    assert rate_limiter.stats["rejected"] == 1
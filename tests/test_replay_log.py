@@ -0,0 +1,41 @@
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+import server  # noqa: E402
+
+FRAME = server.encode_event("new_message", {"content": "x" * 100})
+
+
+def sequences(frames):
+    return [json.loads(frame)["seq"] for frame in frames]
+
+
+def test_byte_cap_evicts_least_recently_active_server_first():
+    replay = server.ReplayLog(size=10, spill=False)
+    frame_bytes = len(replay.record("s1", FRAME))
+    # Room for eleven frames, and the one extra digit of seq 10
+    replay.max_bytes = 11 * frame_bytes + 1
+    replay.record("s1", FRAME)
+    for _ in range(10):
+        replay.record("s2", FRAME)
+
+    assert replay.snapshot() == {"servers": 2, "frames": 11, "bytes": 11 * frame_bytes + 1, "evicted": 1}
+    assert len(replay.logs["s2"]) == 10
+    # The quiet server lost its oldest frame and can still resume after it
+    assert asyncio.run(replay.since("s1", 0)) is None
+    assert sequences(asyncio.run(replay.since("s1", 1))) == [2]
+
+
+def test_byte_cap_drops_servers_that_empty_out():
+    replay = server.ReplayLog(size=10, max_bytes=1, spill=False)
+    replay.record("a", FRAME)
+    replay.record("b", FRAME)
+
+    # Over the cap, only the newest frame of the active server is kept
+    assert list(replay.logs) == ["b"]
+    assert replay.frames == 1 and replay.bytes == len(replay.logs["b"][0][1])
+    assert replay.evicted == 1
+    assert sequences(asyncio.run(replay.since("b", 0))) == [1]
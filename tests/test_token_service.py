@@ -0,0 +1,113 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor", reason="token service tests run against mongomock-motor")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+import server  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+USER = {"user_id": "user-1", "username": "alice"}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient().xalvion_test
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+@pytest.fixture
+def tokens(db):
+    return server.TokenService(secret="test-secret-at-least-32-bytes-long!!")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def rejected(coro) -> str:
+    with pytest.raises(HTTPException) as excinfo:
+        run(coro)
+    assert excinfo.value.status_code == 401
+    return excinfo.value.detail
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = server.BloomFilter(bits=1 << 12, hashes=5)
+    keys = [f"jti-{i}" for i in range(200)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    assert "never-added" not in server.BloomFilter(bits=1 << 12, hashes=5)
+
+
+def test_access_token_round_trip(tokens):
+    claims = run(tokens.verify_access(tokens.issue_access(USER)))
+    assert claims["user_id"] == "user-1"
+    assert claims["type"] == "access"
+
+
+def test_expired_access_token_is_rejected(db):
+    expired = server.TokenService(secret="test-secret-at-least-32-bytes-long!!",
+                                  access_ttl=-(server.JWT_LEEWAY + 5))
+    assert rejected(expired.verify_access(expired.issue_access(USER))) == "Token has expired"
+
+
+def test_cached_claims_expire(tokens, monkeypatch):
+    token = tokens.issue_access(USER)
+    run(tokens.verify_access(token))
+    later = time.time() + tokens.access_ttl + server.JWT_LEEWAY + 1
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert rejected(tokens.verify_access(token)) == "Token has expired"
+
+
+def test_refresh_token_is_not_an_access_token(tokens):
+    refresh = run(tokens.issue_refresh("user-1"))
+    assert rejected(tokens.verify_access(refresh)) == "Invalid token"
+
+
+def test_refresh_rotation_and_replay_revokes_family(tokens, db):
+    first = run(tokens.issue_refresh("user-1"))
+    assert run(tokens.rotate(first)) == "user-1"
+    second = run(tokens.issue_refresh("user-1"))
+
+    # Replaying the rotated token revokes every refresh token of the user
+    assert rejected(tokens.rotate(first)) == "Invalid refresh token"
+    assert tokens.stats["refresh_reuse"] == 1
+    assert rejected(tokens.rotate(second)) == "Invalid refresh token"
+    stored = run(db.refresh_tokens.find({"user_id": "user-1"}).to_list(None))
+    assert len(stored) == 2 and all(token["revoked"] for token in stored)
+
+
+def test_logout_revokes_access_token_on_every_worker(tokens, db):
+    token = tokens.issue_access(USER)
+    claims = run(tokens.verify_access(token))
+    run(tokens.revoke(claims))
+    assert rejected(tokens.verify_access(token)) == "Token has been revoked"
+
+    # Another worker learns about it from the store on its next sync
+    other = server.TokenService(secret=tokens.secret)
+    assert run(other.verify_access(token))["jti"] == claims["jti"]
+    run(other.sync())
+    assert rejected(other.verify_access(token)) == "Token has been revoked"
+
+
+def test_bloom_false_positive_falls_back_to_store(tokens, db):
+    # A one-bit filter answers "maybe revoked" for every key
+    tokens.revoked = server.BloomFilter(bits=1, hashes=1)
+    tokens.revoked.add("some-other-jti")
+    token = tokens.issue_access(USER)
+
+    assert run(tokens.verify_access(token))["user_id"] == "user-1"
+    assert tokens.stats["bloom_hits"] == 1
+    assert tokens.stats["bloom_false_positives"] == 1
+
+    # The store's answer is cached, so a repeat request skips the lookup
+    run(tokens.verify_access(token))
+    assert tokens.stats["bloom_false_positives"] == 2
+    assert len(tokens.confirmed) == 1
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+import server  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def broadcasts(monkeypatch):
+    sent = []
+
+    async def broadcast_to_channel(message, channel_id, coalesce_key=None):
+        sent.append(json.loads(message)["data"])
+    monkeypatch.setattr(server.manager, "broadcast_to_channel", broadcast_to_channel)
+    return sent
+
+
+def typing_user_ids(broadcasts):
+    return [user["user_id"] for user in broadcasts[-1]["users"]]
+
+
+def test_typist_refreshing_every_half_ttl_outlives_the_ttl(clock, broadcasts):
+    typing = server.TypingAggregator(interval=0.1, ttl=6)
+    typing.start_typing("c1", "u1", "alice")
+    asyncio.run(typing.flush())
+    assert typing_user_ids(broadcasts) == ["u1"]
+
+    # Twenty seconds of typing, re-announced every TTL/2 like the client does
+    for _ in range(7):
+        clock.now += 3
+        typing.start_typing("c1", "u1", "alice")
+        asyncio.run(typing.flush())
+    assert typing_user_ids(broadcasts) == ["u1"]
+    assert len(broadcasts) == 1
+    assert typing.stats["expired"] == 0
+
+
+def test_typist_without_refresh_expires_after_ttl(clock, broadcasts):
+    typing = server.TypingAggregator(interval=0.1, ttl=6)
+    typing.start_typing("c1", "u1", "alice")
+    asyncio.run(typing.flush())
+    clock.now += 6.5
+    asyncio.run(typing.flush())
+    assert typing_user_ids(broadcasts) == []
+    assert typing.stats["expired"] == 1